@@ -0,0 +1,636 @@
+"""
+Helpers shared by main.py and main-ordered.py: running Helm, caching and
+parsing chart defaults, JSON output and --batch mode. The diff itself and the
+handling of local values files stay in each script.
+"""
+
+import contextlib
+import datetime
+import functools
+import hashlib
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+try:
+    import orjson  # Optional: fast path for JSON-formatted values files
+except ImportError:
+    orjson = None
+
+
+# --- Configuration ---
+# You might need to adjust this if 'helm' is not in your PATH
+HELM_EXECUTABLE = "helm"
+# Where 'helm show values' output is cached (override with HELM_VALUES_DIFFER_CACHE)
+DEFAULT_CACHE_DIR = "~/.cache/helm-values-differ"
+# Leading whitespace (and optional UTF-8 BOM) followed by '{': possibly JSON
+JSON_OBJECT_START = re.compile(rb"(?:\xef\xbb\xbf)?\s*\{")
+# Upper bound on concurrent Helm fetches in --batch mode
+BATCH_MAX_WORKERS = 8
+
+
+@functools.cache
+def import_pyyaml():
+    """
+    Imports PyYAML on first use and returns (yaml, SafeLoader, NoAliasDumper).
+
+    Deferred so that --help and argument errors don't pay for the import.
+    Prefers the LibYAML-backed C classes; falls back to the pure-Python ones
+    when PyYAML was built without libyaml.
+    """
+    import yaml
+
+    try:
+        from yaml import CSafeLoader as SafeLoader
+    except ImportError:
+        from yaml import SafeLoader
+
+    try:
+        from yaml import CSafeDumper as SafeDumper
+    except ImportError:
+        from yaml import SafeDumper
+
+    class NoAliasDumper(SafeDumper):
+        """
+        Dumper that writes every occurrence of a shared object out in full.
+
+        The diff references subtrees of the local values directly (no copies),
+        and memoized results can appear under several keys; without this the
+        output would contain &id001/*id001 anchors instead of plain values.
+        """
+
+        def ignore_aliases(self, data):
+            return True
+
+    return yaml, SafeLoader, NoAliasDumper
+
+
+def run_helm_command(args_list):
+    """
+    Runs a Helm command and returns its stdout as bytes.
+
+    Output is not decoded: the YAML loaders handle UTF-8 bytes themselves, faster
+    than a Python-level text decode.
+    """
+    command = [HELM_EXECUTABLE] + args_list
+    try:
+        print(f"Running command: {' '.join(command)}", file=sys.stderr)
+        result = subprocess.run(command, capture_output=True, check=True)
+        print("Command successful.", file=sys.stderr)
+        return result.stdout
+    except FileNotFoundError:
+        print(f"Error: '{HELM_EXECUTABLE}' command not found.", file=sys.stderr)
+        print("Please ensure Helm is installed and in your PATH.", file=sys.stderr)
+        sys.exit(1)
+    except subprocess.CalledProcessError as e:
+        print(f"Error running Helm command:", file=sys.stderr)
+        print(f"Command: {' '.join(e.cmd)}", file=sys.stderr)
+        print(f"Return Code: {e.returncode}", file=sys.stderr)
+        print(f"Stderr: {e.stderr.decode('utf-8', 'replace')}", file=sys.stderr)
+        # print(f"Stdout: {e.stdout}", file=sys.stderr) # Often too verbose
+        sys.exit(1)
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+def run_helm_command_streaming(args_list, setup_commands=()):
+    """
+    Starts a Helm command and returns the running Popen object.
+
+    stdout is a binary pipe meant to be fed straight into the YAML parser, so
+    large outputs are never buffered into one Python string and parsing
+    overlaps with Helm producing the output. stderr goes to a temporary file
+    (no risk of a pipe deadlock) and is reported by finish_helm_command().
+
+    setup_commands (e.g. 'repo add'/'repo update' argument lists) are chained
+    in front of the main command with '&&' in a single 'sh -c' invocation, so
+    the whole fetch is one subprocess the caller does not have to wait on step
+    by step. Their stdout is sent to stderr so only the main output is parsed.
+    """
+    command = [HELM_EXECUTABLE] + args_list
+    if setup_commands:
+        script = " && ".join(
+            [shlex.join([HELM_EXECUTABLE] + cmd) + " >&2" for cmd in setup_commands]
+            + [shlex.join(command)]
+        )
+        command = ["sh", "-c", script]
+    try:
+        print(f"Running command: {' '.join(command)}", file=sys.stderr)
+        stderr_file = tempfile.TemporaryFile()
+        proc = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=stderr_file, bufsize=-1
+        )
+        # Popen only sets .stderr for PIPE; keep the file reachable for reporting
+        proc.stderr = stderr_file
+        return proc
+    except FileNotFoundError:
+        print(f"Error: '{HELM_EXECUTABLE}' command not found.", file=sys.stderr)
+        print("Please ensure Helm is installed and in your PATH.", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+def finish_helm_command(proc):
+    """Waits for a command started by run_helm_command_streaming and checks its exit code."""
+    returncode = proc.wait()
+    if returncode != 0:
+        proc.stderr.seek(0)
+        stderr = proc.stderr.read().decode("utf-8", errors="replace")
+        print(f"Error running Helm command:", file=sys.stderr)
+        print(f"Command: {' '.join(proc.args)}", file=sys.stderr)
+        print(f"Return Code: {returncode}", file=sys.stderr)
+        print(f"Stderr: {stderr}", file=sys.stderr)
+        sys.exit(1)
+    print("Command successful.", file=sys.stderr)
+
+
+def values_cache_path(chart_ref, version):
+    """Returns the on-disk cache location for a chart version's default values."""
+    cache_dir = Path(os.environ.get("HELM_VALUES_DIFFER_CACHE", DEFAULT_CACHE_DIR))
+    cache_key = hashlib.sha256(f"{chart_ref}:{version}".encode()).hexdigest()
+    return cache_dir.expanduser() / f"{cache_key}.yaml"
+
+
+def is_cache_fresh(cache_path, ttl=None):
+    """True if cache_path exists and is younger than ttl seconds (None = forever)."""
+    try:
+        age = time.time() - cache_path.stat().st_mtime
+    except OSError:
+        return False
+    return ttl is None or age <= ttl
+
+
+@contextlib.contextmanager
+def cache_writer(cache_path):
+    """
+    Yields a binary file whose contents atomically replace cache_path once the
+    block completes without error (tmp file + os.replace), so a failed or
+    interrupted Helm run never leaves a truncated cache entry behind.
+    Yields None if caching is disabled or the cache dir is not writable.
+    """
+    if cache_path is None:
+        yield None
+        return
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = tempfile.NamedTemporaryFile(
+            dir=cache_path.parent, suffix=".tmp", delete=False
+        )
+    except OSError as e:
+        print(f"Warning: Not caching default values: {e}", file=sys.stderr)
+        yield None
+        return
+    try:
+        with tmp:
+            yield tmp
+    except BaseException:  # Includes SystemExit from Helm/YAML errors
+        os.unlink(tmp.name)
+        raise
+    os.replace(tmp.name, cache_path)
+
+
+class TeeReader:
+    """Read-only file wrapper that copies everything read from source into sink."""
+
+    def __init__(self, source, sink):
+        self.source = source
+        self.sink = sink
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        self.sink.write(data)
+        return data
+
+
+def intern_strings(data):
+    """
+    Replaces every str value in a loaded tree with its interned copy, in place,
+    and returns data.
+
+    Chart defaults repeat many strings (image repositories, pull policies,
+    label values); the loaders allocate a new object for each occurrence, while
+    interning keeps one per distinct value. Equal strings from the local and
+    default trees then also compare by identity. str subclasses (e.g. ruamel's
+    quoted scalars) can't be interned and are left alone.
+    """
+    seen = set()  # Containers shared through YAML aliases are walked once
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            items = node.items()
+        elif isinstance(node, list):
+            items = enumerate(node)
+        else:
+            continue
+        for key, value in items:
+            if type(value) is str:
+                node[key] = sys.intern(value)  # Same keys: safe while iterating
+            elif isinstance(value, (dict, list)) and id(value) not in seen:
+                seen.add(id(value))
+                stack.append(value)
+    return data
+
+
+def parse_yaml_bytes(data):
+    """
+    Parses YAML from bytes, taking a JSON fast path when possible.
+
+    JSON is a subset of YAML and values files rendered by tooling are often
+    plain JSON; orjson (when installed) parses those many times faster than
+    libyaml. Anything that doesn't look like a JSON object, or isn't valid JSON
+    (e.g. a YAML flow mapping like '{a: 1}'), goes through the YAML loader.
+    """
+    if orjson is not None and JSON_OBJECT_START.match(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    yaml, SafeLoader, _ = import_pyyaml()
+    return yaml.load(data, Loader=SafeLoader)
+
+
+class LazyValues:
+    """
+    A composed (parsed, but not constructed) YAML document whose Python values
+    are built only when compare_and_extract_diff reaches them; pass root and
+    resolve to it.
+
+    libyaml does the parsing either way, but constructing Python objects from
+    the node graph runs in Python and is about half the cost of a full load.
+    The diff only looks at the defaults along the local file's keys, so with
+    the usual handful of overrides most of a chart's defaults are never built.
+    The node graph takes more memory than the values it stands for, though.
+    """
+
+    MAP_TAG = "tag:yaml.org,2002:map"
+
+    def __init__(self, root):
+        yaml, _, _ = import_pyyaml()
+        self.yaml = yaml
+        self.root = {} if root is None else root  # Handle empty default values
+        self.constructor = yaml.constructor.SafeConstructor()
+        # Per mapping node: its keys (constructed) and still-lazy value nodes.
+        # Kept, so a node shared through an alias always yields the same dict
+        self.mappings = {}
+
+    def resolve(self, default_val, local_val):
+        """
+        Returns the value to compare local_val against. A mapping node compared
+        with a local map becomes a dict of (still lazy) value nodes; any other
+        node is constructed in full. Already-built values are returned as-is.
+        """
+        if not isinstance(default_val, self.yaml.Node):
+            return default_val
+        try:
+            if isinstance(local_val, dict) and default_val.tag == self.MAP_TAG:
+                mapping = self.mappings.get(default_val)
+                if mapping is None:
+                    self.constructor.flatten_mapping(default_val)  # '<<' merge keys
+                    mapping = self.mappings[default_val] = {}
+                    for key_node, value_node in default_val.value:
+                        key = self.constructor.construct_object(key_node, deep=True)
+                        mapping[key] = value_node
+                return mapping
+            value = self.constructor.construct_object(default_val, deep=True)
+        except (self.yaml.YAMLError, TypeError) as e:  # TypeError: unhashable key
+            print(f"Error parsing default values YAML: {e}", file=sys.stderr)
+            sys.exit(1)
+        if type(value) is str:
+            return sys.intern(value)
+        return intern_strings(value)
+
+
+def compose_values(data):
+    """
+    Like parse_yaml_bytes (data may also be a binary stream), but returns the
+    values as LazyValues. JSON goes through orjson in full, which is fast.
+    """
+    if orjson is not None and isinstance(data, bytes) and JSON_OBJECT_START.match(data):
+        try:
+            return LazyValues(intern_strings(orjson.loads(data)))
+        except orjson.JSONDecodeError:
+            pass
+    yaml, SafeLoader, _ = import_pyyaml()
+    return LazyValues(yaml.compose(data, Loader=SafeLoader))
+
+
+class DefaultValuesFetch:
+    """
+    Fetch of a chart's default values: started on construction, collected with
+    result().
+
+    Chart defaults are immutable for a given version, so the raw Helm output is
+    cached on disk and later runs skip the Helm subprocess entirely, including
+    any setup_commands (repo add/update) that only exist to make it resolvable.
+    On a cache miss Helm starts right away, so the caller can do independent
+    work (e.g. parse the local values file) while Helm resolves the chart.
+
+    The output is parsed with parse_values (bytes or a stream in, LazyValues
+    out; it must raise PyYAML's YAMLError on bad input). The default is the
+    fast compose_values; main.py's --preserve-comments passes a ruamel.yaml
+    parser instead, so both sides are read under the same YAML version.
+    """
+
+    def __init__(
+        self,
+        chart_ref,
+        version,
+        use_cache=True,
+        cache_ttl=None,
+        setup_commands=(),
+        parse_values=compose_values,
+    ):
+        self.chart_ref = chart_ref
+        self.version = version
+        self.setup_commands = setup_commands
+        self.parse_values = parse_values
+        self.cache_path = values_cache_path(chart_ref, version) if use_cache else None
+        self.helm_proc = None
+        if self.cache_path is not None and is_cache_fresh(self.cache_path, cache_ttl):
+            print(
+                f"Using cached default values from {self.cache_path}", file=sys.stderr
+            )
+            if setup_commands:
+                print(
+                    "Skipping Helm repo add/update (defaults cached).", file=sys.stderr
+                )
+        else:
+            self._start_helm()
+
+    def _start_helm(self):
+        helm_values_cmd = ["show", "values", self.chart_ref, "--version", self.version]
+        self.helm_proc = run_helm_command_streaming(
+            helm_values_cmd, self.setup_commands
+        )
+
+    def result(self):
+        """Waits for the fetch and returns the default values as LazyValues."""
+        yaml, _, _ = import_pyyaml()
+        if self.helm_proc is None:
+            try:
+                with open(self.cache_path, "rb") as f:
+                    return self.parse_values(f.read())
+            except (OSError, yaml.YAMLError) as e:
+                print(f"Warning: Ignoring unusable cache entry: {e}", file=sys.stderr)
+                self._start_helm()
+
+        helm_proc = self.helm_proc
+        with cache_writer(self.cache_path) as cache_file:
+            stream = helm_proc.stdout
+            if cache_file is not None:
+                stream = TeeReader(stream, cache_file)
+
+            try:
+                # Parse straight from Helm's stdout pipe instead of buffering it first
+                with helm_proc.stdout:
+                    default_values = self.parse_values(stream)
+            except yaml.YAMLError as e:
+                # A failing Helm run leaves truncated output; report the Helm error first
+                finish_helm_command(helm_proc)
+                print(
+                    f"Error parsing default values YAML from Helm: {e}", file=sys.stderr
+                )
+                sys.exit(1)
+            finish_helm_command(helm_proc)
+
+        return default_values
+
+
+def json_default(value):
+    """
+    Converts values orjson/json can't serialize on their own: YAML timestamps
+    (for the stdlib fallback) and float subclasses such as ruamel's ScalarFloat.
+    """
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, float):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dump_json(data):
+    """
+    Serializes data as indented JSON and returns it as UTF-8 bytes.
+
+    Uses orjson when available, which is far faster than any YAML emitter;
+    falls back to the standard json module otherwise.
+    """
+    if orjson is not None:
+        return orjson.dumps(
+            data,
+            default=json_default,
+            option=orjson.OPT_INDENT_2  # Readable output, like the YAML one
+            | orjson.OPT_NON_STR_KEYS  # YAML allows int/bool keys
+            | orjson.OPT_APPEND_NEWLINE,
+        )
+    text = json.dumps(data, indent=2, ensure_ascii=False, default=json_default)
+    return (text + "\n").encode("utf-8")
+
+
+def resolve_chart_ref(repo, chart, add_repo=False):
+    """
+    Returns (chart_ref, setup_commands): the 'repo/chart' reference Helm needs
+    and, when add_repo is set and repo is 'name=url', the 'repo add' command
+    that makes it resolvable.
+    """
+    chart_ref = f"{repo}/{chart}"  # Helm command needs repo/chart format
+    setup_commands = []  # Helm commands to run before fetching values
+    if add_repo:
+        repo_parts = repo.split("=", 1)
+        if len(repo_parts) == 2:
+            repo_name, repo_url = repo_parts
+            setup_commands.append(["repo", "add", repo_name, repo_url])
+            chart_ref = f"{repo_name}/{chart}"  # Use the added repo name now
+            print(f"Using chart reference: {chart_ref}", file=sys.stderr)
+        else:
+            print(
+                f"Warning: --add-repo specified but --repo '{repo}' is not in 'name=url' format. "
+                f"Assuming '{repo}' is an existing repo name or URL.",
+                file=sys.stderr,
+            )
+            # Proceed assuming repo is usable directly
+    return chart_ref, setup_commands
+
+
+def write_output(payload, output=None):
+    """Writes the rendered diff to the output file, or stdout if output is None."""
+    if not payload:
+        print(
+            "\nNo differences found between local values and defaults.", file=sys.stderr
+        )
+        if output:
+            print(f"Writing empty output file to {output}", file=sys.stderr)
+            try:
+                with open(output, "w", encoding="utf-8") as f:
+                    f.write("")  # Write an empty file
+            except IOError as e:
+                print(f"Error writing empty file {output}: {e}", file=sys.stderr)
+                # Decide if this is a fatal error or not. Non-fatal for now.
+        else:
+            print("(No output generated)", file=sys.stderr)
+        return
+
+    print("\nDifferences identified:", file=sys.stderr)
+    if output:
+        print(f"Writing differences to {output}", file=sys.stderr)
+        try:
+            with open(output, "wb") as f:
+                f.write(payload)
+            print("Output file written successfully.", file=sys.stderr)
+        except IOError as e:
+            print(f"Error writing output file {output}: {e}", file=sys.stderr)
+            sys.exit(1)
+    else:
+        print("\n--- Start of Diff Output ---", file=sys.stderr)
+        sys.stdout.flush()  # Keep ordering with anything printed to stdout before
+        sys.stdout.buffer.write(payload)
+        sys.stdout.buffer.flush()
+        print("--- End of Diff Output ---", file=sys.stderr)
+
+
+def load_batch_manifest(manifest_path, default_format):
+    """
+    Loads a batch manifest: a YAML (or JSON) list of entries with 'local',
+    'repo', 'chart', 'version' and 'output' keys, plus an optional 'format'.
+    Relative paths are resolved against the manifest's directory.
+    """
+    try:
+        with open(manifest_path, "rb") as f:
+            tasks = parse_yaml_bytes(f.read())
+    except Exception as e:  # Missing file or YAML errors
+        print(f"Error reading batch manifest {manifest_path}: {e}", file=sys.stderr)
+        sys.exit(1)
+    if not isinstance(tasks, list) or not tasks:
+        print(
+            f"Error: Batch manifest {manifest_path} must be a non-empty list of entries.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    base_dir = Path(manifest_path).parent
+    required_keys = ("local", "repo", "chart", "version", "output")
+    for index, task in enumerate(tasks):
+        missing = [
+            key
+            for key in required_keys
+            if not isinstance(task, dict) or key not in task
+        ]
+        if missing:
+            print(
+                f"Error: Batch manifest entry {index} is missing: {', '.join(missing)}",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+        if isinstance(task["version"], float):  # 1.10 would silently become 1.1
+            print(
+                f"Error: Batch manifest entry {index} has a numeric version; quote it.",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+        task["version"] = str(task["version"])
+        task["local"] = str(base_dir / task["local"])
+        task["output"] = str(base_dir / task["output"])
+        task.setdefault("format", default_format)
+        if task["format"] not in ("yaml", "json"):
+            print(
+                f"Error: Batch manifest entry {index} has unknown format '{task['format']}'.",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+    return tasks
+
+
+def batch_main(
+    args,
+    load_local_values,
+    compare_and_extract_diff,
+    format_diff,
+    parse_defaults=compose_values,
+):
+    """
+    Diffs every entry of a batch manifest in one process.
+
+    The script-specific steps are passed in: load_local_values(path),
+    compare_and_extract_diff(local, default, resolve_default),
+    format_diff(diff, chart_ref, version, local_file, output_format) and
+    optionally parse_defaults (see DefaultValuesFetch's parse_values).
+
+    Each distinct chart version is fetched once, with up to BATCH_MAX_WORKERS
+    Helm fetches running concurrently, and its parsed defaults are shared by
+    all entries using it. Repo add/update commands run once up front, and only
+    if some chart is not already cached.
+    """
+    import concurrent.futures  # Only batch mode needs it; keeps --help fast
+
+    import_pyyaml()  # Import once here rather than racing in the worker threads
+    tasks = load_batch_manifest(args.batch, args.format)
+
+    setup_commands = []
+    for task in tasks:
+        task["chart_ref"], task_setup = resolve_chart_ref(
+            task["repo"], task["chart"], args.add_repo
+        )
+        setup_commands.extend(cmd for cmd in task_setup if cmd not in setup_commands)
+    if args.update_repo:
+        setup_commands.append(["repo", "update"])
+
+    charts = list(dict.fromkeys((task["chart_ref"], task["version"]) for task in tasks))
+    use_cache = not args.no_cache
+    if setup_commands and not (
+        use_cache
+        and all(
+            is_cache_fresh(values_cache_path(chart_ref, version), args.cache_ttl)
+            for chart_ref, version in charts
+        )
+    ):
+        for cmd in setup_commands:
+            run_helm_command(cmd)
+
+    def fetch_defaults(chart):
+        chart_ref, version = chart
+        return DefaultValuesFetch(
+            chart_ref,
+            version,
+            use_cache=use_cache,
+            cache_ttl=args.cache_ttl,
+            parse_values=parse_defaults,
+        ).result()
+
+    print(f"\nFetching default values for {len(charts)} chart(s)...", file=sys.stderr)
+    failed = 0
+    max_workers = min(BATCH_MAX_WORKERS, len(charts))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        defaults_futures = {
+            chart: executor.submit(fetch_defaults, chart) for chart in charts
+        }
+        # Local files are loaded and diffed here while the remaining fetches run
+        for task in tasks:
+            chart = (task["chart_ref"], task["version"])
+            print(f"\n=== {task['local']} ({chart[0]}:{chart[1]}) ===", file=sys.stderr)
+            try:
+                local_values = load_local_values(task["local"])
+                default_values = defaults_futures[chart].result()
+                diff_values = compare_and_extract_diff(
+                    local_values, default_values.root, default_values.resolve
+                )
+                payload = format_diff(
+                    diff_values, chart[0], chart[1], task["local"], task["format"]
+                )
+                write_output(payload, task["output"])
+            except SystemExit:  # The helpers already reported the error
+                failed += 1
+
+    if failed:
+        print(f"\n{failed} of {len(tasks)} batch entries failed.", file=sys.stderr)
+        sys.exit(1)
+    print(f"\nAll {len(tasks)} batch entries processed.", file=sys.stderr)
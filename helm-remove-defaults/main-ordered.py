@@ -1,51 +1,34 @@
 import argparse
-import subprocess
 import sys
-import yaml
-from copy import deepcopy
-
-# --- Configuration ---
-# You might need to adjust this if 'helm' is not in your PATH
-HELM_EXECUTABLE = "helm"
+from types import NoneType
+
+from helm_common import (
+    DEFAULT_CACHE_DIR,
+    DefaultValuesFetch,
+    batch_main,
+    dump_json,
+    import_pyyaml,
+    intern_strings,
+    parse_yaml_bytes,
+    resolve_chart_ref,
+    write_output,
+)
+
+# Values compared directly by compare_and_extract_diff (never walked into)
+PRIMITIVE_TYPES = frozenset({str, int, bool, float, NoneType})
+# Stack marker used by compare_and_extract_diff once a dict's children are done
+DIFF_DICT_DONE = object()
 
 # --- Helper Functions ---
 
 
-def run_helm_command(args_list):
-    """Runs a Helm command and returns its stdout."""
-    command = [HELM_EXECUTABLE] + args_list
-    try:
-        print(f"Running command: {' '.join(command)}", file=sys.stderr)
-        result = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            check=True,  # Raises CalledProcessError on non-zero exit code
-            encoding="utf-8",
-        )
-        print("Command successful.", file=sys.stderr)
-        return result.stdout
-    except FileNotFoundError:
-        print(f"Error: '{HELM_EXECUTABLE}' command not found.", file=sys.stderr)
-        print("Please ensure Helm is installed and in your PATH.", file=sys.stderr)
-        sys.exit(1)
-    except subprocess.CalledProcessError as e:
-        print(f"Error running Helm command:", file=sys.stderr)
-        print(f"Command: {' '.join(e.cmd)}", file=sys.stderr)
-        print(f"Return Code: {e.returncode}", file=sys.stderr)
-        print(f"Stderr: {e.stderr}", file=sys.stderr)
-        print(f"Stdout: {e.stdout}", file=sys.stderr)
-        sys.exit(1)
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}", file=sys.stderr)
-        sys.exit(1)
-
-
 def load_yaml_file(filepath):
-    """Loads YAML data from a file."""
+    """Loads YAML data from a file; an empty file loads as {}."""
+    yaml, _, _ = import_pyyaml()
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            return yaml.safe_load(f)
+        with open(filepath, "rb") as f:
+            data = intern_strings(parse_yaml_bytes(f.read()))
+        return {} if data is None else data
     except FileNotFoundError:
         print(f"Error: Local values file not found: {filepath}", file=sys.stderr)
         sys.exit(1)
@@ -57,92 +40,186 @@ def load_yaml_file(filepath):
         sys.exit(1)
 
 
-def compare_and_extract_diff(local_val, default_val):
+def compare_and_extract_diff(local_val, default_val, resolve_default=None):
     """
-    Recursively compares local and default values.
+    Compares local and default values.
     Returns a structure containing only the differences introduced by local_val.
-    Returns None if there is no difference at this level.
+    Returns None if there is no difference.
+
+    The trees are walked with an explicit stack rather than recursion: no call
+    frame per node, and no recursion limit on deeply nested values. Kept
+    subtrees are returned by reference, not copied. Safe: the diff is
+    serialized immediately; no callers mutate the returned structure.
+
+    Results for (local, default) node pairs are memoized by object id, so
+    subtrees shared through YAML anchors/aliases are only compared once, and
+    self-referencing anchors end instead of looping. Both trees stay alive and
+    unmodified for the whole pass, so ids are stable.
+
+    Only local keys are ever iterated; defaults outside the local paths are not
+    visited. resolve_default (see LazyValues) lets the defaults be built lazily
+    along those paths: it is called with each default value (and the local
+    value it is compared with) before use, and returns the value to use.
     """
-    # If the types are different, the entire local value is considered a difference
-    if type(local_val) != type(default_val):
-        # Handle cases where one might be None (e.g., key added in local)
-        if local_val is not None:
-            return deepcopy(local_val)
-        else:
-            # This case (local is None but default exists) shouldn't typically
-            # result in keeping the None, unless explicitly set. Usually,
-            # if a default exists and local doesn't override, it's not a diff.
-            return None  # No difference to *keep* from local
-
-    # --- Recursive comparison based on type ---
-
-    # Dictionaries
-    if isinstance(local_val, dict):
-        diff_dict = {}
-        all_keys = set(local_val.keys()) | set(default_val.keys())
-
-        for key in all_keys:
-            local_item = local_val.get(key)
-            default_item = default_val.get(key)
-
-            if key not in default_val:
-                # Key added in local values
-                if local_item is not None:  # Don't add explicit nulls unless intended
-                    diff_dict[key] = deepcopy(local_item)
-            elif key not in local_val:
-                # Key exists in default but removed (or not specified) in local.
-                # This script aims to *keep* local overrides, so we don't mark this as a diff to keep.
-                pass
+    memo = {}
+    # Every work item writes its result into parent[key], where a slot has been
+    # reserved so the diff keeps local key order; an empty result deletes the slot
+    root = {None: None}
+    stack = [(local_val, default_val, root, None)]
+
+    while stack:
+        local_val, default_val, parent, key = stack.pop()
+
+        # Finished dict node (pushed below its children): drop it if it's empty
+        if local_val is DIFF_DICT_DONE:
+            memo_key = default_val
+            memo[memo_key] = parent[key] or None
+            if not parent[key]:
+                del parent[key]
+            continue
+
+        if resolve_default is not None:
+            default_val = resolve_default(default_val, local_val)
+
+        # Scalars are the vast majority of nodes: exact type checks are cheaper
+        # than isinstance. The type check keeps e.g. 1 vs True/1.0 a difference,
+        # and None (local unset) is never a difference to keep.
+        t = type(local_val)
+        if t in PRIMITIVE_TYPES:
+            if local_val is None or (
+                t is type(default_val) and local_val == default_val
+            ):
+                del parent[key]
             else:
-                # Key exists in both, compare recursively
-                sub_diff = compare_and_extract_diff(local_item, default_item)
-                if sub_diff is not None:
-                    diff_dict[key] = sub_diff
-
-        return diff_dict if diff_dict else None  # Return dict only if it has content
-
-    # Lists - Helm overrides usually replace the entire list
-    elif isinstance(local_val, list):
-        # Simple comparison: if lists are different, keep the local one entirely.
-        # More complex list diffing (element-wise) is possible but often not
-        # what's intended with Helm value overrides.
-        if local_val != default_val:
-            return deepcopy(local_val)
+                parent[key] = local_val
+            continue
+
+        memo_key = (id(local_val), id(default_val))
+        if memo_key in memo:
+            result = memo[memo_key]
+        elif type(local_val) is not type(default_val):
+            # A change of type: the entire local value is the difference
+            result = local_val
         else:
-            return None
-
-    # Primitive types (int, float, str, bool, None)
-    else:
-        if local_val != default_val:
-            # Use deepcopy for mutable primitives? Generally not needed for immutables.
-            # But safer if complex objects were ever treated as primitives.
-            return deepcopy(local_val)
+            # Fast path: lists are compared whole anyway, and list __eq__ runs in
+            # C. Dicts only skip the walk when they are the same object: dict
+            # __eq__ treats 1 == True == 1.0, which the walk keeps as a difference.
+            if local_val is default_val:
+                unchanged = True
+            elif isinstance(local_val, dict):
+                unchanged = False
+            else:
+                try:
+                    unchanged = local_val == default_val
+                except RecursionError:  # Too deep for the C comparison
+                    unchanged = False
+
+            if unchanged:
+                result = None
+            # Dictionaries: compare key by key
+            elif isinstance(local_val, dict):
+                diff_dict = parent[key] = {}
+                stack.append((DIFF_DICT_DONE, memo_key, parent, key))
+                # Placeholder until DIFF_DICT_DONE stores the result. The pair can
+                # only be reached again before then as its own descendant (a
+                # self-referencing anchor like 'a: &x {b: *x}'); its differences
+                # are the ones being collected here, so it adds none of its own
+                memo[memo_key] = None
+                # Only local keys can produce a diff: keys that exist only in the
+                # defaults are not overrides to keep.
+                for item_key, local_item in local_val.items():
+                    if item_key not in default_val:
+                        # Key added in local values (don't add explicit nulls)
+                        if local_item is not None:
+                            diff_dict[item_key] = local_item
+                        continue
+                    default_item = default_val[item_key]
+                    if resolve_default is not None and local_item is not None:
+                        default_item = resolve_default(default_item, local_item)
+                    t = type(local_item)
+                    if t in PRIMITIVE_TYPES:
+                        # Decide scalars right here instead of pushing a work item
+                        if local_item is not None and not (
+                            t is type(default_item) and local_item == default_item
+                        ):
+                            diff_dict[item_key] = local_item
+                    else:
+                        diff_dict[item_key] = None  # Reserve the slot (keeps order)
+                        stack.append((local_item, default_item, diff_dict, item_key))
+                continue
+            # Lists (and other scalars, e.g. dates) that differ are kept whole:
+            # Helm overrides replace the entire list, element-wise diffing is
+            # not what's intended.
+            else:
+                result = local_val
+
+        memo[memo_key] = result
+        if result is None:
+            del parent[key]
         else:
-            return None
+            parent[key] = result
+
+    return root.get(None)
 
 
 # --- Main Execution ---
 
 
+def format_diff(diff_values, chart_ref, version, local_values_file, output_format):
+    """
+    Renders the differences as bytes (b"" if there are none), with a comment
+    header for YAML output (JSON has no comments).
+    """
+    if diff_values is None or not diff_values:
+        return b""
+    yaml, _, NoAliasDumper = import_pyyaml()
+    try:
+        if output_format == "json":
+            return dump_json(diff_values)
+        output_body = yaml.dump(
+            diff_values,
+            Dumper=NoAliasDumper,
+            encoding="utf-8",  # Return bytes straight from the emitter
+            indent=2,
+            default_flow_style=False,
+            sort_keys=False,  # Try to preserve key order where possible
+        )
+    except (yaml.YAMLError, TypeError) as e:
+        print(f"Error formatting output {output_format.upper()}: {e}", file=sys.stderr)
+        sys.exit(1)
+    header = (
+        f"# Values overriding chart defaults\n"
+        f"# Generated by helm-values-differ script\n"
+        f"# Chart: {chart_ref}:{version}\n"
+        f"# Based on local file: {local_values_file}\n"
+        f"---\n"
+    )
+    return header.encode("utf-8") + output_body
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Compare a local Helm values file against the chart's defaults "
         "and output only the changed/added values.",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
-    parser.add_argument("local_values_file", help="Path to the local values.yaml file.")
     parser.add_argument(
-        "--repo", required=True, help="Helm chart repository URL or alias."
+        "local_values_file", nargs="?", help="Path to the local values.yaml file."
     )
-    parser.add_argument(
-        "--chart", required=True, help="Helm chart name (e.g., 'prometheus')."
-    )
-    parser.add_argument("--version", required=True, help="Helm chart version.")
+    parser.add_argument("--repo", help="Helm chart repository URL or alias.")
+    parser.add_argument("--chart", help="Helm chart name (e.g., 'prometheus').")
+    parser.add_argument("--version", help="Helm chart version.")
     parser.add_argument(
         "-o",
         "--output",
         help="Output file path. If not specified, prints to standard output.",
     )
+    parser.add_argument(
+        "--batch",
+        metavar="MANIFEST",
+        help="Diff every entry of a YAML manifest (a list of {local, repo, chart, "
+        "version, output}) in one run, instead of a single local values file.",
+    )
     parser.add_argument(
         "--add-repo",
         action="store_true",
@@ -154,119 +231,88 @@ def main():
         action="store_true",
         help="Run 'helm repo update' before fetching values.",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always run 'helm show values' instead of using the on-disk cache "
+        f"in $HELM_VALUES_DIFFER_CACHE (default: {DEFAULT_CACHE_DIR}).",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        help="Maximum age in seconds of a cached chart defaults entry. "
+        "Cached entries never expire by default, since a chart version is immutable.",
+    )
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "--format",
+        choices=("yaml", "json"),
+        default="yaml",
+        help="Output format (default: yaml). JSON output has no header comment "
+        "and is much faster to emit on large diffs.",
+    )
 
-    repo_name_arg = args.repo  # Could be URL or name
-    chart_ref = f"{args.repo}/{args.chart}"  # Helm command needs repo/chart format
+    args = parser.parse_args()
 
-    # Handle optional repo add/update
-    if args.add_repo:
-        repo_parts = args.repo.split("=", 1)
-        if len(repo_parts) == 2:
-            repo_name, repo_url = repo_parts
-            print(
-                f"\nAttempting to add Helm repository '{repo_name}'...", file=sys.stderr
-            )
-            run_helm_command(["repo", "add", repo_name, repo_url])
-            chart_ref = f"{repo_name}/{args.chart}"  # Use the added repo name now
-            print(f"Using chart reference: {chart_ref}", file=sys.stderr)
-        else:
-            print(
-                f"Warning: --add-repo specified but --repo '{args.repo}' is not in 'name=url' format. "
-                f"Assuming '{args.repo}' is an existing repo name or URL.",
-                file=sys.stderr,
+    single_args = {
+        "local_values_file": args.local_values_file,
+        "--repo": args.repo,
+        "--chart": args.chart,
+        "--version": args.version,
+    }
+    if args.batch:
+        if any(value is not None for value in single_args.values()) or args.output:
+            parser.error(
+                "--batch takes files and charts from the manifest; "
+                "it can't be combined with local_values_file, --repo, --chart, "
+                "--version or --output"
             )
-            # Proceed assuming args.repo is usable directly
+        batch_main(args, load_yaml_file, compare_and_extract_diff, format_diff)
+        return
+    missing = [name for name, value in single_args.items() if value is None]
+    if missing:
+        parser.error(f"the following arguments are required: {', '.join(missing)}")
 
+    # Handle optional repo add/update
+    # Deferred: they run chained in front of 'helm show values' (one subprocess)
+    chart_ref, setup_commands = resolve_chart_ref(args.repo, args.chart, args.add_repo)
     if args.update_repo:
-        print("\nUpdating Helm repositories...", file=sys.stderr)
-        run_helm_command(["repo", "update"])
+        setup_commands.append(["repo", "update"])
 
     # 1. Retrieve default values
     print(
         f"\nFetching default values for {chart_ref} version {args.version}...",
         file=sys.stderr,
     )
-    helm_values_cmd = ["show", "values", chart_ref, "--version", args.version]
-    default_values_yaml = run_helm_command(helm_values_cmd)
-
-    try:
-        default_values = yaml.safe_load(default_values_yaml)
-        if default_values is None:  # Handle empty default values
-            default_values = {}
-        print("Default values loaded successfully.", file=sys.stderr)
-    except yaml.YAMLError as e:
-        print(f"Error parsing default values YAML from Helm: {e}", file=sys.stderr)
-        sys.exit(1)
+    defaults_fetch = DefaultValuesFetch(
+        chart_ref,
+        args.version,
+        use_cache=not args.no_cache,
+        cache_ttl=args.cache_ttl,
+        setup_commands=setup_commands,
+    )
 
-    # 2. Load local values
+    # 2. Load local values (while Helm runs in the background)
     print(f"\nLoading local values from {args.local_values_file}...", file=sys.stderr)
     local_values = load_yaml_file(args.local_values_file)
-    if local_values is None:  # Handle empty local file
-        local_values = {}
     print("Local values loaded successfully.", file=sys.stderr)
 
+    print("\nParsing default values...", file=sys.stderr)
+    default_values = defaults_fetch.result()
+    print("Default values loaded successfully.", file=sys.stderr)
+
     # 3. Compare and extract differences
     print("\nComparing values and extracting differences...", file=sys.stderr)
-    diff_values = compare_and_extract_diff(local_values, default_values)
+    diff_values = compare_and_extract_diff(
+        local_values, default_values.root, default_values.resolve
+    )
     print("Comparison complete.", file=sys.stderr)
 
-    # 4. Output the result
-    output_yaml = ""
-    if (
-        diff_values is not None and diff_values
-    ):  # Ensure there are differences to output
-        try:
-            output_yaml = yaml.dump(
-                diff_values,
-                indent=2,
-                default_flow_style=False,
-                sort_keys=False,  # Try to preserve key order where possible
-            )
-        except yaml.YAMLError as e:
-            print(f"Error formatting output YAML: {e}", file=sys.stderr)
-            sys.exit(1)
-
-    if not output_yaml:
-        print(
-            "\nNo differences found between local values and defaults.", file=sys.stderr
-        )
-        # Decide if an empty file should be written or not
-        if args.output:
-            print(f"Writing empty output file to {args.output}", file=sys.stderr)
-            with open(args.output, "w", encoding="utf-8") as f:
-                f.write("")  # Write an empty file
-        else:
-            print("(No output generated)", file=sys.stderr)
-        return  # Exit successfully
-
-    print("\nDifferences identified:", file=sys.stderr)
-    if args.output:
-        print(f"Writing differences to {args.output}", file=sys.stderr)
-        try:
-            with open(args.output, "w", encoding="utf-8") as f:
-                # Add a comment header (optional)
-                f.write("# Values overriding chart defaults\n")
-                f.write("# Generated by helm-values-differ script\n")
-                f.write(f"# Chart: {chart_ref}:{args.version}\n")
-                f.write(f"# Based on local file: {args.local_values_file}\n")
-                f.write("---\n")
-                f.write(output_yaml)
-            print("Output file written successfully.", file=sys.stderr)
-        except IOError as e:
-            print(f"Error writing output file {args.output}: {e}", file=sys.stderr)
-            sys.exit(1)
-    else:
-        print("\n--- Start of Diff Output ---", file=sys.stderr)
-        # Add comment header to stdout as well
-        print("# Values overriding chart defaults")
-        print("# Generated by helm-values-differ script")
-        print(f"# Chart: {chart_ref}:{args.version}")
-        print(f"# Based on local file: {args.local_values_file}")
-        print("---")
-        print(output_yaml)
-        print("--- End of Diff Output ---", file=sys.stderr)
+    # 4. Output the result, built up front so it goes out in a single write
+    payload = format_diff(
+        diff_values, chart_ref, args.version, args.local_values_file, args.format
+    )
+    write_output(payload, args.output)
 
 
 if __name__ == "__main__":
@@ -1,57 +1,59 @@
 import argparse
-import subprocess
+import functools
+import io  # Needed for capturing ruamel.yaml output as bytes
 import sys
-import io  # Needed for capturing ruamel.yaml output as string if needed
-
-# Use ruamel.yaml instead of pyyaml
-from ruamel.yaml import YAML
-from ruamel.yaml.comments import CommentedMap, CommentedSeq
-
-# --- Configuration ---
-HELM_EXECUTABLE = "helm"
+from types import NoneType
+
+from helm_common import (
+    DEFAULT_CACHE_DIR,
+    DefaultValuesFetch,
+    LazyValues,
+    batch_main,
+    compose_values,
+    dump_json,
+    import_pyyaml,
+    intern_strings,
+    parse_yaml_bytes,
+    resolve_chart_ref,
+    write_output,
+)
+
+# Values compared directly by compare_and_extract_diff (never walked into)
+PRIMITIVE_TYPES = frozenset({str, int, bool, float, NoneType})
+# Stack marker used by compare_and_extract_diff once a map's children are done
+DIFF_DICT_DONE = object()
 
 # --- Helper Functions ---
 
 
-def run_helm_command(args_list):
-    """Runs a Helm command and returns its stdout."""
-    command = [HELM_EXECUTABLE] + args_list
-    try:
-        print(f"Running command: {' '.join(command)}", file=sys.stderr)
-        result = subprocess.run(
-            command, capture_output=True, text=True, check=True, encoding="utf-8"
-        )
-        print("Command successful.", file=sys.stderr)
-        return result.stdout
-    except FileNotFoundError:
-        print(f"Error: '{HELM_EXECUTABLE}' command not found.", file=sys.stderr)
-        print("Please ensure Helm is installed and in your PATH.", file=sys.stderr)
-        sys.exit(1)
-    except subprocess.CalledProcessError as e:
-        print(f"Error running Helm command:", file=sys.stderr)
-        print(f"Command: {' '.join(e.cmd)}", file=sys.stderr)
-        print(f"Return Code: {e.returncode}", file=sys.stderr)
-        print(f"Stderr: {e.stderr}", file=sys.stderr)
-        # print(f"Stdout: {e.stdout}", file=sys.stderr) # Often too verbose
-        sys.exit(1)
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}", file=sys.stderr)
-        sys.exit(1)
-
+def load_yaml_data(yaml_string_or_stream, filepath="<string>", preserve_comments=False):
+    """
+    Loads YAML data, preserving key order.
 
-def load_yaml_data(yaml_string_or_stream, filepath="<string>"):
-    """Loads YAML data using ruamel.yaml, preserving order."""
-    yaml = YAML()
-    yaml.preserve_quotes = True  # Optional: Preserve quotes if needed
+    By default parses with PyYAML's (C-accelerated when available) safe loader;
+    plain dicts keep insertion order, so local key order survives. ruamel.yaml
+    round-trip loading is only used when preserve_comments is set.
+    """
     try:
-        # Load ensures CommentedMap/CommentedSeq are used
-        data = yaml.load(yaml_string_or_stream)
+        if preserve_comments:
+            from ruamel.yaml import YAML
+
+            yaml = YAML()
+            yaml.preserve_quotes = True  # Optional: Preserve quotes if needed
+            # Load ensures CommentedMap/CommentedSeq are used
+            data = yaml.load(yaml_string_or_stream)
+        elif isinstance(yaml_string_or_stream, bytes):
+            data = parse_yaml_bytes(yaml_string_or_stream)
+        else:
+            pyyaml, SafeLoader, _ = import_pyyaml()
+            data = pyyaml.load(yaml_string_or_stream, Loader=SafeLoader)
+        intern_strings(data)  # Shrinks large trees; see intern_strings
         # Handle cases where the YAML content is empty or just comments
         if data is None:
-            return CommentedMap()  # Return an empty ordered map
+            return {}  # Plain dicts keep insertion order
         # If top level is a list, wrap it for consistency? Usually values are dicts.
         # Ensure the top level is a map for easier processing later
-        if not isinstance(data, (CommentedMap, dict)):
+        if not isinstance(data, dict):  # CommentedMap is a dict subclass
             print(
                 f"Warning: Top level of YAML in {filepath} is not a dictionary/map. Trying to process anyway.",
                 file=sys.stderr,
@@ -61,80 +63,228 @@ def load_yaml_data(yaml_string_or_stream, filepath="<string>"):
             return data  # Or potentially return CommentedMap({'_root': data}) ?
         return data
 
-    except Exception as e:  # Catch broader ruamel.yaml errors
+    except Exception as e:  # Catch broader ruamel.yaml/PyYAML errors
         print(f"Error parsing YAML {filepath}: {e}", file=sys.stderr)
         sys.exit(1)
 
 
-def compare_and_extract_diff(local_val, default_val):
+def load_defaults_round_trip(data):
+    """
+    Parses chart defaults with ruamel.yaml (YAML 1.2), the way --preserve-comments
+    reads the local file, so both sides agree on scalars such as yes/off/0755.
+    ruamel errors are re-raised as PyYAML's YAMLError for DefaultValuesFetch.
     """
-    Recursively compares local and default values using ruamel types.
+    from ruamel.yaml import YAML
+    from ruamel.yaml.error import YAMLError
+
+    pyyaml, _, _ = import_pyyaml()
+    try:
+        values = YAML(typ="safe", pure=True).load(data)
+    except YAMLError as e:
+        raise pyyaml.YAMLError(str(e)) from e
+    return LazyValues(intern_strings(values))
+
+
+def compare_and_extract_diff(local_val, default_val, resolve_default=None):
+    """
+    Compares local and default values using ruamel types.
     Returns a structure containing only the differences, preserving local order.
-    Returns None if there is no difference at this level.
+    Returns None if there is no difference.
+
+    The trees are walked with an explicit stack rather than recursion, so deeply
+    nested values can't hit the recursion limit.
+
+    Results for (local, default) node pairs are memoized by object id, so
+    subtrees shared through YAML anchors/aliases are only compared once, and
+    self-referencing anchors end instead of looping. Both trees stay alive and
+    unmodified for the whole pass, so ids are stable.
+
+    Only local keys are ever iterated; defaults outside the local paths are not
+    visited. resolve_default (see LazyValues) lets the defaults be built lazily
+    along those paths: it is called with each default value (and the local
+    value it is compared with) before use, and returns the value to use.
     """
-    # If types differ, the local value is the difference (if not None)
-    # Note: ruamel might load simple types as special instances,
-    # type() comparison might be too strict. Use isinstance if needed,
-    # but direct != comparison often works for primitives.
-    # Let's refine type comparison slightly.
-    local_is_map = isinstance(local_val, (CommentedMap, dict))
-    default_is_map = isinstance(default_val, (CommentedMap, dict))
-    local_is_seq = isinstance(local_val, (CommentedSeq, list))
-    default_is_seq = isinstance(default_val, (CommentedSeq, list))
-
-    # If structures fundamentally differ (map vs list vs scalar)
-    if (local_is_map != default_is_map) or (local_is_seq != default_is_seq):
-        # Keep the local value if it exists
-        return local_val if local_val is not None else None
-
-    # --- Recursive comparison based on type ---
-
-    # Dictionaries/Maps (preserve order from local_val)
-    if local_is_map:
-        # Use CommentedMap for the diff to preserve order
-        diff_dict = CommentedMap()
-        # Iterate using local keys first to preserve order
-        for key in local_val:  # Iterating CommentedMap preserves order
-            local_item = local_val[key]
-            default_item = default_val.get(key)  # Use .get for safety
-
-            if key not in default_val:  # Key added locally
-                if (
-                    local_item is not None
-                ):  # Don't add explicit nulls if default didn't have key
-                    diff_dict[key] = (
-                        local_item  # Assign directly preserves ruamel type/comments
-                    )
-            else:  # Key exists in both, compare recursively
-                sub_diff = compare_and_extract_diff(local_item, default_item)
-                if sub_diff is not None:
-                    diff_dict[key] = sub_diff  # Assign diff result
-
-        # If diff_dict is empty, return None
-        return diff_dict if diff_dict else None
-
-    # Lists/Sequences - Helm overrides usually replace the entire list
-    elif local_is_seq:
-        # Simple comparison: if lists differ content-wise, keep the local one entirely.
-        # ruamel sequences compared with != should work for content comparison.
-        if local_val != default_val:
-            # Assign directly to preserve ruamel type/comments
-            return local_val
+    memo = {}
+    # Every work item writes its result into parent[key], where a slot has been
+    # reserved so the diff keeps local key order; an empty result deletes the slot
+    root = {None: None}
+    stack = [(local_val, default_val, root, None)]
+
+    while stack:
+        local_val, default_val, parent, key = stack.pop()
+
+        # Finished map node (pushed below its children): drop it if it's empty
+        if local_val is DIFF_DICT_DONE:
+            memo_key = default_val
+            memo[memo_key] = parent[key] or None
+            if not parent[key]:
+                del parent[key]
+            continue
+
+        if resolve_default is not None:
+            default_val = resolve_default(default_val, local_val)
+
+        # Scalars are the vast majority of nodes: exact type checks are cheaper
+        # than isinstance. ruamel scalar subclasses (quoted strings, ScalarFloat,
+        # ...) take the slow path below.
+        if type(local_val) in PRIMITIVE_TYPES:
+            if local_val is not None and local_val != default_val:
+                parent[key] = local_val
+            else:
+                del parent[key]
+            continue
+
+        memo_key = (id(local_val), id(default_val))
+        if memo_key in memo:
+            result = memo[memo_key]
         else:
-            return None
-
-    # Primitive types (int, float, str, bool, None, etc.)
-    else:
-        if local_val != default_val:
-            # Assign directly
-            return local_val
+            # Fast path: identical subtrees (the common case for most of a values
+            # file) need no walking. dict/list __eq__ (also used by CommentedMap/
+            # CommentedSeq) run in C and bail out early on a length mismatch.
+            try:
+                unchanged = local_val is default_val or local_val == default_val
+            except RecursionError:  # Too deep for the C comparison: walk it instead
+                unchanged = False
+
+            if unchanged:
+                result = None
+            # Maps on both sides: compare key by key (preserve order from local_val).
+            # isinstance, since ruamel loads CommentedMap (a dict subclass)
+            elif isinstance(local_val, dict) and isinstance(default_val, dict):
+                # Same map type as the input: CommentedMap when round-tripping
+                diff_dict = parent[key] = type(local_val)()
+                stack.append((DIFF_DICT_DONE, memo_key, parent, key))
+                # Placeholder until DIFF_DICT_DONE stores the result. The pair can
+                # only be reached again before then as its own descendant (a
+                # self-referencing anchor like 'a: &x {b: *x}'); its differences
+                # are the ones being collected here, so it adds none of its own
+                memo[memo_key] = None
+                for item_key, local_item in local_val.items():
+                    if item_key not in default_val:  # Key added locally
+                        # Don't add explicit nulls if default didn't have key.
+                        # Assign directly, preserves ruamel type/comments
+                        if local_item is not None:
+                            diff_dict[item_key] = local_item
+                        continue
+                    default_item = default_val[item_key]
+                    if resolve_default is not None and local_item is not None:
+                        default_item = resolve_default(default_item, local_item)
+                    if type(local_item) in PRIMITIVE_TYPES:
+                        # Decide scalars right here instead of pushing a work item
+                        if local_item is not None and local_item != default_item:
+                            diff_dict[item_key] = local_item
+                    else:
+                        diff_dict[item_key] = None  # Reserve the slot (keeps order)
+                        stack.append((local_item, default_item, diff_dict, item_key))
+                continue
+            # Anything else that differs is kept whole: a change of structure,
+            # other scalars, and sequences, since Helm overrides usually replace
+            # the entire list. Assign directly to preserve ruamel type/comments.
+            else:
+                result = local_val
+
+        memo[memo_key] = result
+        if result is None:
+            del parent[key]
         else:
-            return None
+            parent[key] = result
+
+    return root.get(None)
+
+
+def dump_yaml(data, preserve_comments=False):
+    """
+    Serializes data as YAML and returns it as UTF-8 bytes.
+
+    The diff is a derived artifact, so by default it is emitted with PyYAML's
+    (C-accelerated when available) safe dumper, keeping key order. ruamel.yaml's
+    much slower round-trip dumper is only used with preserve_comments, to carry
+    comments and quoting from the local file over to the output.
+    """
+    if preserve_comments:
+        from ruamel.yaml import YAML
+
+        yaml_out = YAML()
+        yaml_out.indent(mapping=2, sequence=4, offset=2)  # Standard YAML indentation
+        yaml_out.preserve_quotes = True  # Preserve quotes from original where possible
+        yaml_out.width = 4096  # Set a very large width to prevent line wrapping
+        buffer = io.BytesIO()
+        yaml_out.dump(data, buffer)
+        return buffer.getvalue()
+    pyyaml, _, NoAliasDumper = import_pyyaml()
+    return pyyaml.dump(
+        data,
+        Dumper=NoAliasDumper,
+        encoding="utf-8",  # Return bytes straight from the emitter
+        sort_keys=False,  # Keep the local file's key order
+        default_flow_style=False,
+        allow_unicode=True,
+        width=4096,
+        indent=2,
+    )
 
 
 # --- Main Execution ---
 
 
+def load_values_file(filepath, preserve_comments=False):
+    """Reads and parses a values file (see load_yaml_data)."""
+    try:
+        with open(filepath, "rb") as f:
+            return load_yaml_data(
+                f.read(), filepath=filepath, preserve_comments=preserve_comments
+            )
+    except FileNotFoundError:
+        print(f"Error: Local values file not found: {filepath}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:  # Catch other file errors
+        print(f"Error reading file {filepath}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+def format_diff(
+    diff_values,
+    chart_ref,
+    version,
+    local_values_file,
+    output_format,
+    preserve_comments=False,
+):
+    """
+    Renders the differences as bytes (b"" if there are none), with a comment
+    header for YAML output (JSON has no comments).
+    """
+    if diff_values is None or (
+        isinstance(diff_values, (dict, list)) and not diff_values
+    ):
+        # Nothing to output; a changed scalar (even a falsy one) still counts
+        return b""
+
+    # JSON has no comments, so it goes out as-is without the header
+    if output_format == "json":
+        try:
+            return dump_json(diff_values)
+        except TypeError as e:
+            print(f"Error dumping JSON: {e}", file=sys.stderr)
+            sys.exit(1)
+
+    # Prepare header comment
+    header = (
+        f"# Values overriding chart defaults\n"
+        f"# Generated by helm-values-differ script\n"
+        f"# Chart: {chart_ref}:{version}\n"
+        f"# Based on local file: {local_values_file}\n"
+        f"---\n"
+    )
+    try:
+        return header.encode("utf-8") + dump_yaml(
+            diff_values, preserve_comments=preserve_comments
+        )
+    except Exception as e:  # Catch ruamel/PyYAML errors during dump
+        print(f"Error dumping YAML: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Compare a local Helm values file against the chart's defaults "
@@ -142,19 +292,23 @@ def main():
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
     # ... (Arguments remain the same as before) ...
-    parser.add_argument("local_values_file", help="Path to the local values.yaml file.")
     parser.add_argument(
-        "--repo", required=True, help="Helm chart repository URL or alias."
+        "local_values_file", nargs="?", help="Path to the local values.yaml file."
     )
-    parser.add_argument(
-        "--chart", required=True, help="Helm chart name (e.g., 'prometheus')."
-    )
-    parser.add_argument("--version", required=True, help="Helm chart version.")
+    parser.add_argument("--repo", help="Helm chart repository URL or alias.")
+    parser.add_argument("--chart", help="Helm chart name (e.g., 'prometheus').")
+    parser.add_argument("--version", help="Helm chart version.")
     parser.add_argument(
         "-o",
         "--output",
         help="Output file path. If not specified, prints to standard output.",
     )
+    parser.add_argument(
+        "--batch",
+        metavar="MANIFEST",
+        help="Diff every entry of a YAML manifest (a list of {local, repo, chart, "
+        "version, output}) in one run, instead of a single local values file.",
+    )
     parser.add_argument(
         "--add-repo",
         action="store_true",
@@ -166,135 +320,111 @@ def main():
         action="store_true",
         help="Run 'helm repo update' before fetching values.",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always run 'helm show values' instead of using the on-disk cache "
+        f"in $HELM_VALUES_DIFFER_CACHE (default: {DEFAULT_CACHE_DIR}).",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        help="Maximum age in seconds of a cached chart defaults entry. "
+        "Cached entries never expire by default, since a chart version is immutable.",
+    )
+    parser.add_argument(
+        "--preserve-comments",
+        action="store_true",
+        help="Parse with ruamel.yaml round-trip loader to keep comments and quoting "
+        "from the local file in the output (slower on large charts).",
+    )
 
-    args = parser.parse_args()
+    parser.add_argument(
+        "--format",
+        choices=("yaml", "json"),
+        default="yaml",
+        help="Output format (default: yaml). JSON output has no header comment "
+        "and is much faster to emit on large diffs.",
+    )
 
-    repo_name_arg = args.repo
-    chart_ref = f"{args.repo}/{args.chart}"
+    args = parser.parse_args()
 
-    # ... (Repo add/update logic remains the same) ...
-    if args.add_repo:
-        repo_parts = args.repo.split("=", 1)
-        if len(repo_parts) == 2:
-            repo_name, repo_url = repo_parts
-            print(
-                f"\nAttempting to add Helm repository '{repo_name}'...", file=sys.stderr
-            )
-            run_helm_command(["repo", "add", repo_name, repo_url])
-            chart_ref = f"{repo_name}/{args.chart}"  # Use the added repo name now
-            print(f"Using chart reference: {chart_ref}", file=sys.stderr)
-        else:
-            print(
-                f"Warning: --add-repo specified but --repo '{args.repo}' is not in 'name=url' format. "
-                f"Assuming '{args.repo}' is an existing repo name or URL.",
-                file=sys.stderr,
+    single_args = {
+        "local_values_file": args.local_values_file,
+        "--repo": args.repo,
+        "--chart": args.chart,
+        "--version": args.version,
+    }
+    if args.batch:
+        if any(value is not None for value in single_args.values()) or args.output:
+            parser.error(
+                "--batch takes files and charts from the manifest; "
+                "it can't be combined with local_values_file, --repo, --chart, "
+                "--version or --output"
             )
+        batch_main(
+            args,
+            functools.partial(
+                load_values_file, preserve_comments=args.preserve_comments
+            ),
+            compare_and_extract_diff,
+            functools.partial(format_diff, preserve_comments=args.preserve_comments),
+            load_defaults_round_trip if args.preserve_comments else compose_values,
+        )
+        return
+    missing = [name for name, value in single_args.items() if value is None]
+    if missing:
+        parser.error(f"the following arguments are required: {', '.join(missing)}")
 
+    # Repo add/update run chained in front of 'helm show values' (one subprocess)
+    chart_ref, setup_commands = resolve_chart_ref(args.repo, args.chart, args.add_repo)
     if args.update_repo:
-        print("\nUpdating Helm repositories...", file=sys.stderr)
-        run_helm_command(["repo", "update"])
+        setup_commands.append(["repo", "update"])
 
     # 1. Retrieve default values
     print(
         f"\nFetching default values for {chart_ref} version {args.version}...",
         file=sys.stderr,
     )
-    helm_values_cmd = ["show", "values", chart_ref, "--version", args.version]
-    default_values_yaml_str = run_helm_command(helm_values_cmd)
-    print("Parsing default values...", file=sys.stderr)
-    default_values = load_yaml_data(
-        default_values_yaml_str, filepath=f"defaults:{chart_ref}:{args.version}"
+    defaults_fetch = DefaultValuesFetch(
+        chart_ref,
+        args.version,
+        use_cache=not args.no_cache,
+        cache_ttl=args.cache_ttl,
+        setup_commands=setup_commands,
+        parse_values=(
+            load_defaults_round_trip if args.preserve_comments else compose_values
+        ),
     )
-    print("Default values loaded.", file=sys.stderr)
 
-    # 2. Load local values
+    # 2. Load local values (while Helm runs in the background)
     print(f"\nLoading local values from {args.local_values_file}...", file=sys.stderr)
-    try:
-        with open(args.local_values_file, "r", encoding="utf-8") as f:
-            local_values = load_yaml_data(f, filepath=args.local_values_file)
-        print("Local values loaded successfully.", file=sys.stderr)
-    except FileNotFoundError:
-        print(
-            f"Error: Local values file not found: {args.local_values_file}",
-            file=sys.stderr,
-        )
-        sys.exit(1)
-    except Exception as e:  # Catch other file errors
-        print(f"Error reading file {args.local_values_file}: {e}", file=sys.stderr)
-        sys.exit(1)
+    local_values = load_values_file(
+        args.local_values_file, preserve_comments=args.preserve_comments
+    )
+    print("Local values loaded successfully.", file=sys.stderr)
+
+    print("\nParsing default values...", file=sys.stderr)
+    default_values = defaults_fetch.result()
+    print("Default values loaded.", file=sys.stderr)
 
     # 3. Compare and extract differences
     print("\nComparing values and extracting differences...", file=sys.stderr)
-    diff_values = compare_and_extract_diff(local_values, default_values)
+    diff_values = compare_and_extract_diff(
+        local_values, default_values.root, default_values.resolve
+    )
     print("Comparison complete.", file=sys.stderr)
 
-    # 4. Output the result using ruamel.yaml
-    output_generated = False
-    if diff_values is not None and (
-        (isinstance(diff_values, (CommentedMap, dict)) and diff_values)
-        or (isinstance(diff_values, (CommentedSeq, list)) and diff_values)
-        or (not isinstance(diff_values, (CommentedMap, dict, CommentedSeq, list)))
-    ):
-        # Condition checks if diff_values is not None AND (it's a non-empty map OR it's a non-empty sequence OR it's a scalar value)
-        output_generated = True
-
-    if not output_generated:
-        print(
-            "\nNo differences found between local values and defaults.", file=sys.stderr
-        )
-        if args.output:
-            print(f"Writing empty output file to {args.output}", file=sys.stderr)
-            try:
-                with open(args.output, "w", encoding="utf-8") as f:
-                    f.write("")  # Write an empty file
-            except IOError as e:
-                print(f"Error writing empty file {args.output}: {e}", file=sys.stderr)
-                # Decide if this is a fatal error or not. Non-fatal for now.
-        else:
-            print("(No output generated)", file=sys.stderr)
-        return  # Exit successfully
-
-    # Prepare ruamel.yaml dumper
-    yaml_out = YAML()
-    yaml_out.indent(mapping=2, sequence=4, offset=2)  # Standard YAML indentation
-    yaml_out.preserve_quotes = True  # Preserve quotes from original where possible
-    yaml_out.width = 4096  # Set a very large width to prevent line wrapping
-
-    print("\nDifferences identified:", file=sys.stderr)
-
-    # Prepare header comment
-    header = (
-        f"# Values overriding chart defaults\n"
-        f"# Generated by helm-values-differ script\n"
-        f"# Chart: {chart_ref}:{args.version}\n"
-        f"# Based on local file: {args.local_values_file}\n"
-        f"---\n"
+    # 4. Output the result, built up front so it goes out in a single write
+    payload = format_diff(
+        diff_values,
+        chart_ref,
+        args.version,
+        args.local_values_file,
+        args.format,
+        preserve_comments=args.preserve_comments,
     )
-
-    if args.output:
-        print(f"Writing differences to {args.output}", file=sys.stderr)
-        try:
-            with open(args.output, "w", encoding="utf-8") as f:
-                f.write(header)
-                yaml_out.dump(diff_values, f)  # Dump directly to file stream
-            print("Output file written successfully.", file=sys.stderr)
-        except IOError as e:
-            print(f"Error writing output file {args.output}: {e}", file=sys.stderr)
-            sys.exit(1)
-        except Exception as e:  # Catch ruamel errors during dump
-            print(f"Error dumping YAML to {args.output}: {e}", file=sys.stderr)
-            sys.exit(1)
-    else:
-        print("\n--- Start of Diff Output ---", file=sys.stderr)
-        print(header, end="")  # Print header without extra newline
-        # Dump to a string buffer and then print, to ensure it goes to stdout
-        string_stream = io.StringIO()
-        yaml_out.dump(diff_values, string_stream)
-        print(
-            string_stream.getvalue(), end=""
-        )  # Print dumped yaml without extra newline
-        string_stream.close()
-        print("--- End of Diff Output ---", file=sys.stderr)
+    write_output(payload, args.output)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,29 @@
+import asyncio
 import csv
+import functools
 import json
 import logging
+import threading
 import pymysql
+import sqlite3
+from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict, Optional, Tuple
+from itertools import chain, groupby, zip_longest
+from operator import itemgetter
+from typing import AsyncIterator, Iterable, Iterator, List, Dict, Optional, Tuple
 from datetime import datetime
 from pymysql import Error
 
+try:
+	from dbutils.pooled_db import PooledDB  # Opcional: pool de conexiones (pip install DBUtils)
+except ImportError:
+	PooledDB = None
+
+try:
+	import aiomysql  # Opcional: análisis asíncrono (pip install aiomysql)
+except ImportError:
+	aiomysql = None
+
 # Configurar logging
 logging.basicConfig(
 	level=logging.INFO,
@@ -18,6 +35,122 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Tipos que no se miden: se guardan fuera de la página de la fila, así que calcular su
+# longitud obliga a leerlos enteros, y rara vez permiten reducir el tipo
+UNMEASURED_TYPES = {'longtext', 'longblob', 'mediumtext', 'mediumblob', 'json'}
+
+# Posición de cada campo en las tuplas de columna: las filas de COLUMNS_QUERY sin table_schema,
+# tal como las devuelve el cursor de tuplas (no se convierten en dicts)
+(COL_TABLE, COL_NAME, COL_DATA_TYPE, COL_COLUMN_TYPE, COL_CHAR_MAX_LENGTH,
+ COL_NUM_PRECISION, COL_NUM_SCALE, COL_IS_NULLABLE, COL_DEFAULT) = range(9)
+
+# Bases de datos cuyos metadatos se obtienen en cada consulta a information_schema
+METADATA_BATCH_SIZE = 200
+
+# Metadatos de todas las tablas de un lote de bases de datos en una sola consulta
+COLUMNS_QUERY = """
+	SELECT table_schema, table_name, column_name, data_type, column_type, character_maximum_length, 
+		   numeric_precision, numeric_scale, is_nullable, column_default
+	FROM information_schema.columns 
+	WHERE table_schema IN ({placeholders})
+	ORDER BY table_schema, table_name, ordinal_position
+"""
+
+# Estimación de filas y última modificación de las estadísticas del motor (no recorre las tablas)
+TABLE_ROWS_QUERY = """
+	SELECT table_schema, table_name, table_rows, update_time
+	FROM information_schema.tables
+	WHERE table_schema IN ({placeholders})
+"""
+
+# Metadatos de una base de datos: columnas, filas estimadas y última modificación de cada tabla
+TableMetadata = Tuple[Dict[str, List[Tuple]], Dict[str, Optional[int]], Dict[str, Optional[datetime]]]
+
+
+def _ident(name: str) -> str:
+	"""Cita un identificador (base de datos, tabla o columna) con backticks escapando los internos"""
+	return "`" + name.replace("`", "``") + "`"
+
+
+def _first_value(row) -> Optional[int]:
+	"""Primer valor de una fila de resultado (None si la consulta no devolvió filas)"""
+	return row[0] if row else None
+
+
+def _suggest_text(data_type: str, column_type: str, char_max_length: Optional[int],
+		num_precision: Optional[int], num_scale: Optional[int], max_length: Optional[int]) -> str:
+	"""Tipos de texto"""
+	if max_length is None:
+		return column_type
+	
+	if max_length <= 8 and data_type == 'varchar':
+		return f"CHAR({max_length})"
+	elif max_length <= 255:
+		return f"VARCHAR({max_length})"
+	elif max_length <= 65535:
+		return "TEXT"
+	elif max_length <= 16777215:
+		return "MEDIUMTEXT"
+	else:
+		return "LONGTEXT"
+
+
+def _suggest_int(data_type: str, column_type: str, char_max_length: Optional[int],
+		num_precision: Optional[int], num_scale: Optional[int], max_length: Optional[int]) -> str:
+	"""Tipos numéricos enteros"""
+	if max_length is None:
+		return column_type
+	
+	if data_type == 'int' and max_length < 5:
+		return "SMALLINT"
+	elif data_type == 'int' and max_length < 3:
+		return "TINYINT"
+	elif data_type == 'bigint' and max_length < 10:
+		return "INT"
+	else:
+		return column_type
+
+
+def _suggest_decimal(data_type: str, column_type: str, char_max_length: Optional[int],
+		num_precision: Optional[int], num_scale: Optional[int], max_length: Optional[int]) -> str:
+	"""Tipos decimal"""
+	if num_precision and num_scale:
+		return f"DECIMAL({num_precision},{num_scale})"
+	else:
+		return "DECIMAL(10,2)"
+
+
+def _suggest_same(data_type: str, column_type: str, char_max_length: Optional[int],
+		num_precision: Optional[int], num_scale: Optional[int], max_length: Optional[int]) -> str:
+	"""Fechas/horas y cualquier otro tipo: se mantiene igual"""
+	return column_type
+
+
+# Función de sugerencia según el tipo de dato (en minúsculas)
+_DISPATCH = {
+	'varchar': _suggest_text,
+	'char': _suggest_text,
+	'int': _suggest_int,
+	'bigint': _suggest_int,
+	'smallint': _suggest_int,
+	'tinyint': _suggest_int,
+	'decimal': _suggest_decimal,
+	'datetime': _suggest_same,
+	'timestamp': _suggest_same,
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def _suggest(data_type: str, column_type: str, char_max_length: Optional[int],
+		num_precision: Optional[int], num_scale: Optional[int], max_length: Optional[int]) -> str:
+	"""
+	Decide el tipo optimizado a partir de valores primitivos (cacheado, se repiten mucho entre columnas).
+	Si el tipo se mantiene, devuelve column_type completo (con longitud, precisión, unsigned...)
+	"""
+	return _DISPATCH.get(data_type, _suggest_same)(
+		data_type, column_type, char_max_length, num_precision, num_scale, max_length
+	)
+
 
 class MariaDBSchemaOptimizer:
 	def __init__(self, config_file: str = 'config.json'):
@@ -25,6 +158,14 @@ class MariaDBSchemaOptimizer:
 		self.config = self.load_config(config_file)
 		self.excluded_dbs = ['information_schema', 'performance_schema', 'mysql', 'sys']
 		
+		# Pool de conexiones, se crea al pedir la primera conexión
+		self.pool = None
+		self.pool_lock = threading.Lock()
+		
+		# Caché de longitudes máximas entre ejecuciones, se abre al primer uso
+		self.cache = None
+		self.cache_lock = threading.Lock()
+		
 		# Configurar nivel de logging
 		log_level = getattr(logging, self.config.get('log_level', 'INFO').upper())
 		logger.setLevel(log_level)
@@ -47,20 +188,49 @@ class MariaDBSchemaOptimizer:
 			logger.error(f"Error al cargar configuración: {e}")
 			raise
 	
+	def get_connection_params(self) -> Dict:
+		"""Parámetros de conexión comunes a las conexiones directas y al pool"""
+		# para linux:
+		return dict(
+			unix_socket="/var/run/mysqld/mysqld.sock",  # Ruta del socket
+			user=self.config['user'],
+			password=self.config.get('password'),
+			charset='utf8mb4',
+			cursorclass=pymysql.cursors.DictCursor,
+			connect_timeout=10
+		)
+	
+	def get_pool(self):
+		"""Devuelve el pool de conexiones, creándolo la primera vez"""
+		with self.pool_lock:
+			if self.pool is None:
+				max_workers = self.config.get('max_workers', 5)
+				self.pool = PooledDB(
+					creator=pymysql,
+					mincached=2,
+					maxcached=max_workers * 2,
+					maxconnections=max_workers * 4,
+					blocking=True,  # Esperar una conexión libre en vez de fallar
+					**self.get_connection_params()
+				)
+			return self.pool
+	
 	def get_connection(self, database: Optional[str] = None) -> pymysql.Connection:
 		"""Establece conexión con la base de datos especificada"""
 		try:
-			# para linux:
+			if PooledDB is None:
+				return pymysql.connect(database=database, **self.get_connection_params())
 			
-			conn = pymysql.connect(
-				unix_socket="/var/run/mysqld/mysqld.sock",  # Ruta del socket
-				user=self.config['user'],
-				password=self.config.get('password'),
-				database=database,
-				charset='utf8mb4',
-				cursorclass=pymysql.cursors.DictCursor,
-				connect_timeout=10
-			)
+			# Conexión del pool: close() la devuelve al pool en vez de cerrarla
+			conn = self.get_pool().connection()
+			if database:
+				# Las conexiones del pool se reutilizan entre bases de datos
+				try:
+					with conn.cursor() as cursor:
+						cursor.execute(f"USE {_ident(database)}")
+				except Error:
+					conn.close()
+					raise
 			return conn
 		except Error as e:
 			logger.error(f"Error al conectar a {database if database else 'servidor'}: {e}")
@@ -91,258 +261,608 @@ class MariaDBSchemaOptimizer:
 			if conn:
 				conn.close()
 	
-	def analyze_database(self, database: str) -> List[Dict]:
-		"""Analiza una base de datos individual"""
+	def list_tables(self, database: str) -> TableMetadata:
+		"""
+		Obtiene las columnas de todas las tablas de una base de datos, agrupadas por tabla,
+		el número aproximado de filas y la fecha de última modificación de cada tabla
+		(None para vistas o si el motor no la registra)
+		"""
+		return self.list_all_tables([database])[database]
+	
+	def list_all_tables(self, databases: List[str]) -> Dict[str, TableMetadata]:
+		"""
+		Obtiene los metadatos de varias bases de datos (como list_tables) con una consulta
+		por lote. Los tenants con el mismo esquema comparten los metadatos de columnas.
+		"""
+		metadata = {}
+		schemas = {}
+		
+		for start in range(0, len(databases), METADATA_BATCH_SIZE):
+			batch = databases[start:start + METADATA_BATCH_SIZE]
+			conn = None
+			try:
+				logger.info(f"Obteniendo metadatos de {len(batch)} bases de datos")
+				conn = self.get_connection()
+				placeholders = ', '.join(['%s'] * len(batch))
+				
+				# Cursor de tuplas: evita crear un dict por fila en las consultas masivas
+				with conn.cursor(pymysql.cursors.Cursor) as cursor:
+					cursor.execute(COLUMNS_QUERY.format(placeholders=placeholders), batch)
+					column_rows = cursor.fetchall()
+					cursor.execute(TABLE_ROWS_QUERY.format(placeholders=placeholders), batch)
+					estimate_rows = cursor.fetchall()
+				
+				metadata.update(self.group_metadata(batch, column_rows, estimate_rows, schemas))
+			except Exception as e:
+				logger.error(f"Error al obtener metadatos de {', '.join(batch)}: {e}")
+				metadata.update({db: ({}, {}, {}) for db in batch})
+			finally:
+				if conn:
+					conn.close()
+		
+		logger.info(f"{len(schemas)} esquemas distintos entre {len(databases)} bases de datos")
+		return metadata
+	
+	def group_metadata(self, databases: List[str], column_rows, estimate_rows,
+					   schemas: Dict) -> Dict[str, TableMetadata]:
+		"""
+		Agrupa las filas de metadatos por base de datos y tabla. `schemas` guarda las columnas
+		por firma de esquema, así los tenants idénticos reutilizan las mismas (solo lectura)
+		"""
+		metadata = {db: ({}, {}, {}) for db in databases}
+		
+		for db, rows in groupby(column_rows, key=itemgetter(0)):
+			signature = tuple(row[1:] for row in rows)
+			columns_by_table = schemas.get(signature)
+			if columns_by_table is None:
+				columns_by_table = defaultdict(list)
+				for row in signature:
+					columns_by_table[row[COL_TABLE]].append(row)
+				schemas[signature] = columns_by_table
+			metadata[db] = (columns_by_table, {}, {})
+		
+		for db, table, table_rows, update_time in estimate_rows:
+			if db in metadata:
+				metadata[db][1][table] = table_rows
+				metadata[db][2][table] = update_time
+		
+		return metadata
+	
+	def analyze_table(self, database: str, table: str, columns: List[Tuple],
+					  row_estimate: Optional[int] = None,
+					  update_time: Optional[datetime] = None) -> List[Dict]:
+		"""Analiza las columnas de una tabla individual"""
 		conn = None
 		schema_info = []
 		
 		try:
-			logger.info(f"Analizando base de datos: {database}")
-			conn = self.get_connection(database)
+			logger.debug(f"Procesando tabla: {database}.{table}")
 			
-			with conn.cursor() as cursor:
-				# Obtener todas las tablas
-				cursor.execute(f"SHOW TABLES")
-				tables = [row[f"Tables_in_{database}"] for row in cursor.fetchall()]
-				
-				for table in tables:
-					logger.debug(f"Procesando tabla: {table}")
-					
-					# Obtener información de columnas
-					cursor.execute(f"""
-						SELECT column_name, data_type, character_maximum_length, 
-							   numeric_precision, numeric_scale, is_nullable, column_default
-						FROM information_schema.columns 
-						WHERE table_schema = %s AND table_name = %s
-					""", (database, table))
-					columns = cursor.fetchall()
-					
-					for column in columns:
-						try:
-							max_length = self.get_column_max_length(conn, table, column)
-							optimized_type = self.suggest_optimized_type(column, max_length)
-							
-							schema_info.append({
-								'database': database,
-								'table': table,
-								'column': column['column_name'],
-								'current_type': column['data_type'],
-								'max_length': max_length,
-								'is_nullable': column['is_nullable'],
-								'has_default': column['column_default'] is not None,
-								'optimized_type': optimized_type,
-								'analysis_time': datetime.now().isoformat()
-							})
-						except Exception as e:
-							logger.error(f"Error procesando columna {table}.{column['column_name']}: {e}")
-							continue
+			if row_estimate == 0:
+				# Tabla vacía según las estadísticas: no hay datos que medir
+				max_lengths = [None] * len(columns)
+			else:
+				max_lengths = self.get_cached_max_lengths(database, table, columns, row_estimate, update_time)
+				if max_lengths is None:
+					# Longitudes máximas de todas las columnas en un solo recorrido de la tabla
+					sample_rows = self.get_sample_rows(database, table, row_estimate)
+					conn = self.get_connection(database)
+					max_lengths, complete = self.get_table_max_lengths(conn, table, columns, sample_rows)
+					if complete and not sample_rows:
+						# No se guardan mediciones fallidas ni muestreadas (pueden quedarse cortas):
+						# se repiten en la próxima ejecución
+						self.store_max_lengths(database, table, columns, row_estimate, update_time, max_lengths)
 			
+			self.build_schema_rows(schema_info, database, table, columns, max_lengths)
 			return schema_info
 		except Exception as e:
-			logger.error(f"Error al analizar base de datos {database}: {e}")
-			return []
+			logger.error(f"Error al analizar tabla {database}.{table}: {e}")
+			return schema_info
 		finally:
 			if conn:
 				conn.close()
 	
-	def get_column_max_length(self, conn: pymysql.Connection, table: str, column: Dict) -> Optional[int]:
-	    """Calcula la longitud máxima de los datos en una columna específica"""
-	    try:
-	        with conn.cursor() as cursor:
-	            col_name = column['column_name']
-	            data_type = column['data_type'].lower()
-	            
-	            # Seguridad para evitar inyecciones SQL
-	            safe_col = column['column_name']
-	            safe_table = table
-	            
-	            # Determinamos la consulta según el tipo de dato
-	            if 'varchar' in data_type or 'text' in data_type:
-	                query = f"""
-	                    SELECT MAX(
-	                        CASE 
-	                            WHEN {safe_col} IS NULL THEN NULL
-	                            ELSE CHAR_LENGTH({safe_col})
-	                        END
-	                    ) AS max_len 
-	                    FROM {safe_table}
-	                """
-	            elif 'blob' in data_type:
-	                query = f"""
-	                    SELECT MAX(
-	                        CASE 
-	                            WHEN {safe_col} IS NULL THEN NULL
-	                            ELSE LENGTH({safe_col})
-	                        END
-	                    ) AS max_len 
-	                    FROM {safe_table}
-	                """
-	            elif 'int' in data_type or 'decimal' in data_type:
-	                query = f"""
-	                    SELECT MAX(
-	                        CASE 
-	                            WHEN {safe_col} IS NULL THEN NULL
-	                            ELSE CHAR_LENGTH(CAST({safe_col} AS CHAR))
-	                        END
-	                    ) AS max_len 
-	                    FROM {safe_table}
-	                """
-	            elif 'date' in data_type or 'datetime' in data_type or 'timestamp' in data_type:
-	                query = f"""
-	                    SELECT MAX(
-	                        CASE 
-	                            WHEN {safe_col} IS NULL THEN NULL
-	                            ELSE CHAR_LENGTH(CAST({safe_col} AS CHAR))
-	                        END
-	                    ) AS max_len 
-	                    FROM {safe_table}
-	                """
-	            elif 'enum' in data_type or 'set' in data_type:
-	                query = f"""
-	                    SELECT MAX(
-	                        CASE 
-	                            WHEN {safe_col} IS NULL THEN NULL
-	                            ELSE CHAR_LENGTH({safe_col})
-	                        END
-	                    ) AS max_len 
-	                    FROM {safe_table}
-	                """
-	            else:
-	                # Para cualquier otro tipo que no esté cubierto, usamos una consulta genérica
-	                query = f"""
-	                    SELECT MAX(
-	                        CASE 
-	                            WHEN {safe_col} IS NULL THEN NULL
-	                            ELSE CHAR_LENGTH(CAST({safe_col} AS CHAR))
-	                        END
-	                    ) AS max_len 
-	                    FROM {safe_table}
-	                """
-	            
-	            cursor.execute(query)
-	            result = cursor.fetchone()
-	            return result['max_len'] if result else None
-
-	    except Exception as e:
-	        logger.error(f"Error al obtener longitud máxima para {table}.{col_name}: {e}")
-	        return None
-
+	def get_cache(self) -> Optional[sqlite3.Connection]:
+		"""
+		Devuelve la caché SQLite de longitudes máximas, abriéndola la primera vez
+		(None si está desactivada). Debe llamarse con cache_lock adquirido.
+		"""
+		cache_file = self.config.get('cache_file', 'schema_cache.db')
+		if not cache_file:
+			return None
+		if self.cache is None:
+			self.cache = sqlite3.connect(cache_file, check_same_thread=False)
+			self.cache.execute("""
+				CREATE TABLE IF NOT EXISTS column_cache (
+					db TEXT, tbl TEXT, col TEXT, row_count INT, update_time TEXT, max_length INT,
+					PRIMARY KEY (db, tbl, col)
+				)
+			""")
+		return self.cache
 	
-	def suggest_optimized_type(self, column: Dict, max_length: Optional[int]) -> str:
-		"""Sugiere un tipo de dato optimizado basado en el uso actual"""
-		data_type = column['data_type'].lower()
-		char_max_length = column['character_maximum_length']
-		num_precision = column['numeric_precision']
-		num_scale = column['numeric_scale']
-		
-		# Para tipos de texto
-		if data_type in ('varchar', 'char'):
-			if max_length is None:
-				return data_type + (f"({char_max_length})" if char_max_length else "")
-			
-			if max_length <= 8 and data_type == 'varchar':
-				return f"CHAR({max_length})"
-			elif max_length <= 255:
-				return f"VARCHAR({max_length})"
-			elif max_length <= 65535:
-				return "TEXT"
-			elif max_length <= 16777215:
-				return "MEDIUMTEXT"
-			else:
-				return "LONGTEXT"
+	def get_cached_max_lengths(self, database: str, table: str, columns: List[Tuple],
+							   row_estimate: Optional[int],
+							   update_time: Optional[datetime]) -> Optional[List[Optional[int]]]:
+		"""
+		Devuelve las longitudes guardadas en una ejecución anterior si la tabla no ha cambiado
+		(mismas filas y update_time), o None si hay que recorrerla
+		"""
+		if update_time is None:
+			return None  # Sin fecha de modificación no se puede saber si la tabla cambió
 		
-		# Para tipos numéricos
-		elif data_type in ('int', 'bigint', 'smallint', 'tinyint'):
-			if max_length is None:
-				return data_type
-			
-			if data_type == 'int' and max_length < 5:
-				return "SMALLINT"
-			elif data_type == 'int' and max_length < 3:
-				return "TINYINT"
-			elif data_type == 'bigint' and max_length < 10:
-				return "INT"
-			else:
-				return data_type
+		try:
+			with self.cache_lock:
+				cache = self.get_cache()
+				if cache is None:
+					return None
+				cached = dict(cache.execute(
+					"SELECT col, max_length FROM column_cache "
+					"WHERE db = ? AND tbl = ? AND row_count IS ? AND update_time = ?",
+					(database, table, row_estimate, str(update_time))
+				).fetchall())
+		except sqlite3.Error as e:
+			logger.warning(f"Error al leer la caché para {database}.{table}: {e}")
+			return None
 		
-		# Para tipos decimal
-		elif data_type == 'decimal':
-			if num_precision and num_scale:
-				return f"DECIMAL({num_precision},{num_scale})"
-			else:
-				return "DECIMAL(10,2)"
+		if any(column[COL_NAME] not in cached for column in columns
+			   if column[COL_DATA_TYPE].lower() not in UNMEASURED_TYPES):
+			return None
+		
+		logger.debug(f"Tabla {database}.{table} sin cambios, usando longitudes en caché")
+		return [cached.get(column[COL_NAME]) for column in columns]
+	
+	def store_max_lengths(self, database: str, table: str, columns: List[Tuple],
+						  row_estimate: Optional[int], update_time: Optional[datetime],
+						  max_lengths: List[Optional[int]]):
+		"""Guarda las longitudes medidas para reutilizarlas mientras la tabla no cambie"""
+		if update_time is None:
+			return
 		
-		# Para tipos fecha/hora
-		elif data_type in ('datetime', 'timestamp'):
-			return data_type
+		try:
+			with self.cache_lock:
+				cache = self.get_cache()
+				if cache is None:
+					return
+				with cache:  # Confirma la transacción al salir
+					cache.executemany(
+						"INSERT OR REPLACE INTO column_cache VALUES (?, ?, ?, ?, ?, ?)",
+						[
+							(database, table, column[COL_NAME], row_estimate, str(update_time), max_length)
+							for column, max_length in zip(columns, max_lengths)
+						]
+					)
+		except sqlite3.Error as e:
+			logger.warning(f"Error al guardar la caché para {database}.{table}: {e}")
+	
+	def get_sample_rows(self, database: str, table: str, row_estimate: Optional[int]) -> Optional[int]:
+		"""Devuelve cuántas filas muestrear si la tabla supera el umbral configurado (None = tabla completa)"""
+		sample_threshold = self.config.get('sample_threshold_rows')
+		if sample_threshold and row_estimate and row_estimate > sample_threshold:
+			sample_rows = self.config.get('sample_rows', 1000000)
+			logger.info(f"Tabla {database}.{table} (~{row_estimate} filas): "
+						f"longitudes estimadas sobre {sample_rows} filas")
+			return sample_rows
+		return None
+	
+	def build_schema_rows(self, schema_info: List[Dict], database: str, table: str,
+						  columns: List[Tuple], max_lengths: List[Optional[int]]):
+		"""Añade a schema_info una fila de resultado por columna con su tipo sugerido"""
+		for column, max_length in zip(columns, max_lengths):
+			try:
+				optimized_type = self.suggest_optimized_type(column, max_length)
+				
+				schema_info.append({
+					'database': database,
+					'table': table,
+					'column': column[COL_NAME],
+					'current_type': column[COL_DATA_TYPE],
+					'current_column_type': column[COL_COLUMN_TYPE],
+					'max_length': max_length,
+					'is_nullable': column[COL_IS_NULLABLE],
+					'has_default': column[COL_DEFAULT] is not None,
+					'optimized_type': optimized_type,
+					'analysis_time': datetime.now().isoformat()
+				})
+			except Exception as e:
+				logger.error(f"Error procesando columna {table}.{column[COL_NAME]}: {e}")
+				continue
+	
+	def analyze_database(self, database: str) -> List[Dict]:
+		"""Analiza una base de datos individual"""
+		schema_info = []
+		columns_by_table, row_estimates, update_times = self.list_tables(database)
+		for table, columns in columns_by_table.items():
+			schema_info.extend(self.analyze_table(
+				database, table, columns, row_estimates.get(table), update_times.get(table)
+			))
+		return schema_info
+	
+	def get_length_expression(self, column: Tuple) -> str:
+		"""Devuelve la expresión SQL que mide la longitud de los datos de una columna"""
+		data_type = column[COL_DATA_TYPE].lower()
+		col = _ident(column[COL_NAME])
 		
-		# Para otros tipos, mantener igual
+		# Determinamos la expresión según el tipo de dato
+		if 'varchar' in data_type or 'text' in data_type:
+			return f"CHAR_LENGTH({col})"
+		elif 'blob' in data_type:
+			return f"LENGTH({col})"
+		elif 'int' in data_type or 'decimal' in data_type:
+			return f"CHAR_LENGTH(CAST({col} AS CHAR))"
+		elif 'enum' in data_type or 'set' in data_type:
+			return f"CHAR_LENGTH({col})"
 		else:
-			return data_type
+			# Fechas y cualquier otro tipo: longitud de su representación como texto
+			return f"CHAR_LENGTH(CAST({col} AS CHAR))"
+	
+	def get_table_source(self, table: str, columns: List[Tuple], sample_rows: Optional[int] = None) -> str:
+		"""Devuelve la tabla a recorrer o, si se muestrea, una subconsulta con sus primeras filas"""
+		if not sample_rows:
+			return _ident(table)
+		column_list = ', '.join(_ident(column[COL_NAME]) for column in columns)
+		return f"(SELECT {column_list} FROM {_ident(table)} LIMIT {int(sample_rows)}) AS sample"
+	
+	def get_table_max_lengths(self, conn: pymysql.Connection, table: str, columns: List[Tuple],
+							  sample_rows: Optional[int] = None) -> Tuple[List[Optional[int]], bool]:
+		"""
+		Calcula la longitud máxima de todas las columnas de una tabla recorriéndola una sola vez.
+		Devuelve también si se midieron todas las columnas (False si alguna consulta falló)
+		"""
+		max_lengths = [None] * len(columns)
+		measured = self.get_measured_columns(columns)
+		if not measured:
+			return max_lengths, True
+		
+		source = self.get_table_source(table, [column for _, column in measured], sample_rows)
+		try:
+			with conn.cursor(pymysql.cursors.Cursor) as cursor:
+				cursor.execute(self.get_max_lengths_query(measured, source))
+				self.set_max_lengths(max_lengths, measured, cursor.fetchone())
+				return max_lengths, True
+		except Exception as e:
+			# Si falla la consulta agregada, se intenta columna por columna
+			logger.warning(f"Error en consulta agregada para {table}, analizando por columna: {e}")
+			complete = True
+			for i, column in measured:
+				try:
+					max_lengths[i] = self.get_column_max_length(conn, table, column, source)
+				except Exception as e:
+					logger.error(f"Error al obtener longitud máxima para {table}.{column[COL_NAME]}: {e}")
+					complete = False
+			return max_lengths, complete
+	
+	def get_measured_columns(self, columns: List[Tuple]) -> List[Tuple[int, Tuple]]:
+		"""Devuelve las columnas cuya longitud se mide, con su posición en la tabla"""
+		return [
+			(i, column) for i, column in enumerate(columns)
+			if column[COL_DATA_TYPE].lower() not in UNMEASURED_TYPES
+		]
+	
+	def get_max_lengths_query(self, measured: List[Tuple[int, Tuple]], source: str) -> str:
+		"""Construye la consulta con un MAX por columna medida (MAX ignora los NULL)"""
+		parts = [
+			f"MAX({self.get_length_expression(column)}) AS `m_{i}`"
+			for i, column in measured
+		]
+		return f"SELECT {', '.join(parts)} FROM {source}"
+	
+	def set_max_lengths(self, max_lengths: List[Optional[int]], measured: List[Tuple[int, Tuple]], result):
+		"""Copia en max_lengths la fila devuelta por get_max_lengths_query (un MAX por columna medida)"""
+		if result:
+			for pos, (i, _) in enumerate(measured):
+				max_lengths[i] = result[pos]
+	
+	def get_column_max_length_query(self, column: Tuple, source: str) -> str:
+		"""Construye la consulta de la longitud máxima de una sola columna"""
+		return f"SELECT MAX({self.get_length_expression(column)}) AS max_len FROM {source}"
+	
+	def get_column_max_length(self, conn: pymysql.Connection, table: str, column: Tuple,
+							  source: Optional[str] = None) -> Optional[int]:
+		"""Calcula la longitud máxima de los datos en una columna específica (propaga los errores)"""
+		if column[COL_DATA_TYPE].lower() in UNMEASURED_TYPES:
+			return None  # Se mantiene el tipo actual
+		
+		source = source or _ident(table)
+		with conn.cursor(pymysql.cursors.Cursor) as cursor:
+			cursor.execute(self.get_column_max_length_query(column, source))
+			return _first_value(cursor.fetchone())
 	
+	def suggest_optimized_type(self, column: Tuple, max_length: Optional[int]) -> str:
+		"""Sugiere un tipo de dato optimizado basado en el uso actual"""
+		return _suggest(
+			column[COL_DATA_TYPE].lower(),
+			column[COL_COLUMN_TYPE],
+			column[COL_CHAR_MAX_LENGTH],
+			column[COL_NUM_PRECISION],
+			column[COL_NUM_SCALE],
+			max_length
+		)
+
 	def analyze_all_databases_parallel(self, max_workers: int = 5) -> List[Dict]:
-		"""Analiza todas las bases de datos en paralelo"""
+		"""Analiza todas las bases de datos en paralelo y devuelve todas las filas en una lista"""
+		return list(self.stream_all_databases(max_workers))
+	
+	def stream_all_databases(self, max_workers: int = 5) -> Iterator[Dict]:
+		"""
+		Analiza todas las bases de datos en paralelo, repartiendo el trabajo por tabla, y
+		devuelve las filas a medida que termina cada tabla (sin acumularlas en memoria)
+		"""
+		if self.config.get('use_async'):
+			if aiomysql is not None:
+				yield from self.stream_all_databases_async(max_workers)
+				return
+			logger.warning("use_async requiere aiomysql (pip install aiomysql), se usan threads")
+		
 		databases = self.get_all_databases()
-		all_schema_info = []
+		total_columns = 0
+		
+		# Límite de tablas analizadas a la vez dentro de una misma base de datos
+		max_per_db = self.config.get('max_workers_per_db', max_workers)
+		db_semaphores = {db: threading.Semaphore(max_per_db) for db in databases}
+		
+		def analyze_table_limited(db: str, table: str, columns: List[Tuple], row_estimate: Optional[int],
+								  update_time: Optional[datetime]) -> List[Dict]:
+			with db_semaphores[db]:
+				return self.analyze_table(db, table, columns, row_estimate, update_time)
 		
 		logger.info(f"Iniciando análisis paralelo con {max_workers} workers")
 		
 		with ThreadPoolExecutor(max_workers=max_workers) as executor:
-			futures = {executor.submit(self.analyze_database, db): db for db in databases}
+			# Primero los metadatos de todas las bases de datos
+			tables_by_db = self.list_all_tables(databases)
+			
+			# Luego una tarea por tabla, intercalando bases de datos para repartir la carga
+			pending_tables = {db: len(tables) for db, (tables, _, _) in tables_by_db.items()}
+			columns_by_db = defaultdict(int)
+			table_lists = [
+				[
+					(db, table, columns, row_estimates.get(table), update_times.get(table))
+					for table, columns in tables.items()
+				]
+				for db, (tables, row_estimates, update_times) in tables_by_db.items()
+			]
+			futures = {
+				executor.submit(analyze_table_limited, *task): task[:2]
+				for round_tasks in zip_longest(*table_lists)
+				for task in round_tasks if task is not None
+			}
 			
 			for future in as_completed(futures):
-				db = futures[future]
+				# Se suelta la referencia para que el resultado se libere al consumirlo
+				db, table = futures.pop(future)
+				result = []
 				try:
 					result = future.result()
-					if result:
-						all_schema_info.extend(result)
-						logger.info(f"Completado análisis de {db} ({len(result)} columnas)")
 				except Exception as e:
-					logger.error(f"Error en análisis de {db}: {e}")
+					logger.error(f"Error en análisis de {db}.{table}: {e}")
+				
+				columns_by_db[db] += len(result)
+				total_columns += len(result)
+				pending_tables[db] -= 1
+				if not pending_tables[db]:
+					logger.info(f"Completado análisis de {db} ({columns_by_db[db]} columnas)")
+				
+				yield from result
+		
+		logger.info(f"Análisis completado. Total de columnas procesadas: {total_columns}")
+	
+	async def list_all_tables_async(self, pool, databases: List[str]) -> Dict[str, TableMetadata]:
+		"""Versión asíncrona de list_all_tables"""
+		metadata = {}
+		schemas = {}
+		
+		for start in range(0, len(databases), METADATA_BATCH_SIZE):
+			batch = databases[start:start + METADATA_BATCH_SIZE]
+			try:
+				logger.info(f"Obteniendo metadatos de {len(batch)} bases de datos")
+				placeholders = ', '.join(['%s'] * len(batch))
+				async with pool.acquire() as conn:
+					async with conn.cursor() as cursor:
+						await cursor.execute(COLUMNS_QUERY.format(placeholders=placeholders), batch)
+						column_rows = await cursor.fetchall()
+						await cursor.execute(TABLE_ROWS_QUERY.format(placeholders=placeholders), batch)
+						estimate_rows = await cursor.fetchall()
+				
+				metadata.update(self.group_metadata(batch, column_rows, estimate_rows, schemas))
+			except Exception as e:
+				logger.error(f"Error al obtener metadatos de {', '.join(batch)}: {e}")
+				metadata.update({db: ({}, {}, {}) for db in batch})
+		
+		logger.info(f"{len(schemas)} esquemas distintos entre {len(databases)} bases de datos")
+		return metadata
+	
+	async def analyze_table_async(self, pool, database: str, table: str, columns: List[Tuple],
+								  row_estimate: Optional[int] = None,
+								  update_time: Optional[datetime] = None) -> List[Dict]:
+		"""Versión asíncrona de analyze_table"""
+		schema_info = []
+		
+		try:
+			logger.debug(f"Procesando tabla: {database}.{table}")
+			
+			max_lengths = [None] * len(columns)
+			measured = self.get_measured_columns(columns)
+			cached = None
+			if row_estimate != 0 and measured:
+				cached = self.get_cached_max_lengths(database, table, columns, row_estimate, update_time)
+			if cached is not None:
+				max_lengths = cached
+			elif row_estimate != 0 and measured:
+				sample_rows = self.get_sample_rows(database, table, row_estimate)
+				source = self.get_table_source(table, [column for _, column in measured], sample_rows)
+				complete = True
+				
+				async with pool.acquire() as conn:
+					# Las conexiones del pool se reutilizan entre bases de datos
+					await conn.select_db(database)
+					async with conn.cursor() as cursor:
+						try:
+							await cursor.execute(self.get_max_lengths_query(measured, source))
+							self.set_max_lengths(max_lengths, measured, await cursor.fetchone())
+						except Exception as e:
+							# Si falla la consulta agregada, se intenta columna por columna
+							logger.warning(f"Error en consulta agregada para {table}, analizando por columna: {e}")
+							for i, column in measured:
+								try:
+									await cursor.execute(self.get_column_max_length_query(column, source))
+									max_lengths[i] = _first_value(await cursor.fetchone())
+								except Exception as e:
+									logger.error(f"Error al obtener longitud máxima para {table}.{column[COL_NAME]}: {e}")
+									complete = False
+				
+				if complete and not sample_rows:
+					# No se guardan mediciones fallidas ni muestreadas (pueden quedarse cortas):
+					# se repiten en la próxima ejecución
+					self.store_max_lengths(database, table, columns, row_estimate, update_time, max_lengths)
+			
+			self.build_schema_rows(schema_info, database, table, columns, max_lengths)
+			return schema_info
+		except Exception as e:
+			logger.error(f"Error al analizar tabla {database}.{table}: {e}")
+			return schema_info
+	
+	def stream_all_databases_async(self, max_workers: int = 5) -> Iterator[Dict]:
+		"""Versión síncrona de analyze_all_databases_async: avanza el event loop tabla a tabla"""
+		loop = asyncio.new_event_loop()
+		results = self.analyze_all_databases_async(max_workers)
+		try:
+			while True:
+				try:
+					rows = loop.run_until_complete(results.__anext__())
+				except StopAsyncIteration:
+					break
+				yield from rows
+		finally:
+			loop.run_until_complete(results.aclose())
+			loop.close()
+	
+	async def analyze_all_databases_async(self, max_workers: int = 5) -> AsyncIterator[List[Dict]]:
+		"""
+		Analiza todas las bases de datos con aiomysql en un único event loop, devolviendo
+		las filas de cada tabla al terminarla. max_workers limita las consultas simultáneas
+		(tamaño del pool).
+		"""
+		databases = self.get_all_databases()
+		total_columns = 0
+		
+		params = self.get_connection_params()
+		del params['cursorclass']  # Cursor de tuplas por defecto
+		pool = await aiomysql.create_pool(minsize=1, maxsize=max_workers, autocommit=True, **params)
+		
+		# Límite de tablas analizadas a la vez dentro de una misma base de datos
+		max_per_db = self.config.get('max_workers_per_db', max_workers)
+		db_semaphores = {db: asyncio.Semaphore(max_per_db) for db in databases}
+		
+		async def analyze_table_limited(db: str, table: str, columns: List[Tuple], row_estimate: Optional[int],
+										update_time: Optional[datetime]) -> List[Dict]:
+			async with db_semaphores[db]:
+				return await self.analyze_table_async(pool, db, table, columns, row_estimate, update_time)
 		
-		logger.info(f"Análisis completado. Total de columnas procesadas: {len(all_schema_info)}")
-		return all_schema_info
+		logger.info(f"Iniciando análisis asíncrono con {max_workers} conexiones")
+		
+		pending = {}
+		try:
+			# Primero los metadatos de todas las bases de datos
+			tables_by_db = await self.list_all_tables_async(pool, databases)
+			
+			# Luego una tarea por tabla, intercalando bases de datos para repartir la carga
+			pending_tables = {db: len(tables) for db, (tables, _, _) in tables_by_db.items()}
+			columns_by_db = defaultdict(int)
+			table_lists = [
+				[
+					(db, table, columns, row_estimates.get(table), update_times.get(table))
+					for table, columns in tables.items()
+				]
+				for db, (tables, row_estimates, update_times) in tables_by_db.items()
+			]
+			pending = {
+				asyncio.ensure_future(analyze_table_limited(*task)): task[0]
+				for round_tasks in zip_longest(*table_lists)
+				for task in round_tasks if task is not None
+			}
+			
+			while pending:
+				done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+				for task in done:
+					db = pending.pop(task)
+					result = task.result()
+					
+					columns_by_db[db] += len(result)
+					total_columns += len(result)
+					pending_tables[db] -= 1
+					if not pending_tables[db]:
+						logger.info(f"Completado análisis de {db} ({columns_by_db[db]} columnas)")
+					
+					yield result
+		finally:
+			# Si se deja de consumir antes de terminar, se cancelan las tablas pendientes
+			for task in pending:
+				task.cancel()
+			if pending:
+				await asyncio.gather(*pending, return_exceptions=True)
+			pool.close()
+			await pool.wait_closed()
+		
+		logger.info(f"Análisis completado. Total de columnas procesadas: {total_columns}")
 	
-	def generate_optimization_report(self, data: List[Dict], output_file: str):
-		"""Genera un reporte CSV con recomendaciones de optimización"""
-		if not data:
+	def generate_optimization_report(self, data: Iterable[Dict], output_file: str):
+		"""
+		Genera un reporte CSV con recomendaciones de optimización. Las filas se escriben a
+		medida que llegan, así que data puede ser un generador como stream_all_databases().
+		"""
+		rows = iter(data)
+		first = next(rows, None)
+		if first is None:
 			logger.warning("No hay datos para generar el reporte")
 			return
 		
+		# Estadísticas del resumen, acumuladas mientras se escribe
+		stats = {'databases': set(), 'tables': set(), 'columns': 0, 'optimizations': 0}
+		
+		def count_rows(rows: Iterable[Dict]) -> Iterator[Dict]:
+			for row in rows:
+				stats['databases'].add(row['database'])
+				stats['tables'].add((row['database'], row['table']))
+				stats['columns'] += 1
+				if row['optimized_type'].lower() != row['current_column_type'].lower():
+					stats['optimizations'] += 1
+				yield row
+		
 		try:
-			with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
+			# Búfer de 1 MiB para reducir las llamadas a write() en reportes grandes
+			with open(output_file, 'w', newline='', encoding='utf-8', buffering=1 << 20) as csvfile:
 				fieldnames = [
-					'database', 'table', 'column', 'current_type', 
+					'database', 'table', 'column', 'current_type', 'current_column_type',
 					'max_length', 'is_nullable', 'has_default',
 					'optimized_type', 'analysis_time'
 				]
 				
 				writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
 				writer.writeheader()
-				
-				for row in data:
-					writer.writerow(row)
+				writer.writerows(count_rows(chain([first], rows)))
 			
 			logger.info(f"Reporte generado exitosamente: {output_file}")
 			
 			# Generar resumen estadístico
-			self.generate_summary_report(data, output_file.replace('.csv', '_summary.txt'))
+			self.generate_summary_report(stats, output_file.replace('.csv', '_summary.txt'))
 		except Exception as e:
 			logger.error(f"Error al generar reporte CSV: {e}")
 			raise
 	
-	def generate_summary_report(self, data: List[Dict], output_file: str):
-		"""Genera un reporte resumen con estadísticas"""
+	def generate_summary_report(self, stats: Dict, output_file: str):
+		"""Genera un reporte resumen con las estadísticas acumuladas al escribir el CSV"""
 		try:
-			optimizations = sum(1 for row in data if row['optimized_type'].lower() != row['current_type'].lower())
-			total_columns = len(data)
+			databases = stats['databases']
+			tables = stats['tables']
+			optimizations = stats['optimizations']
+			total_columns = stats['columns']
 			
 			with open(output_file, 'w') as f:
 				f.write(f"Resumen de Optimización de Esquema\n")
 				f.write(f"Fecha: {datetime.now().isoformat()}\n")
 				f.write(f"\n")
-				f.write(f"Total de bases de datos analizadas: {len({row['database'] for row in data})}\n")
-				f.write(f"Total de tablas analizadas: {len({(row['database'], row['table']) for row in data})}\n")
+				f.write(f"Total de bases de datos analizadas: {len(databases)}\n")
+				f.write(f"Total de tablas analizadas: {len(tables)}\n")
 				f.write(f"Total de columnas analizadas: {total_columns}\n")
 				f.write(f"Columnas con sugerencia de optimización: {optimizations} ({optimizations/total_columns:.1%})\n")
 				f.write(f"\n")
@@ -362,8 +882,8 @@ if __name__ == "__main__":
 		# Inicializar optimizador
 		optimizer = MariaDBSchemaOptimizer('config.json')
 		
-		# Realizar análisis en paralelo
-		schema_data = optimizer.analyze_all_databases_parallel(
+		# Realizar análisis en paralelo; las filas se escriben en el reporte según llegan
+		schema_data = optimizer.stream_all_databases(
 			max_workers=optimizer.config.get('max_workers', 5)
 		)
 		
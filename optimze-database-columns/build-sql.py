@@ -1,43 +1,78 @@
 import csv
+from itertools import groupby
+from operator import itemgetter
 from typing import List, Dict
 from pathlib import Path
 
 
+def _ident(name: str) -> str:
+    """
+    Cita un identificador con backticks, escapando los backticks internos.
+    """
+    return "`" + name.replace("`", "``") + "`"
+
+
 def generate_alter_queries(csv_path: str) -> List[str]:
     """
     Genera consultas ALTER TABLE a partir de un archivo CSV con recomendaciones de optimización de esquema.
+
+    Los cambios de una misma tabla se agrupan en un único ALTER TABLE con varios
+    MODIFY COLUMN, de modo que la tabla se reconstruye una sola vez.
     """
-    queries = []
+    changes = []
 
     try:
         with open(csv_path, mode="r", encoding="utf-8") as csv_file:
-            csv_reader = csv.DictReader(csv_file)
+            csv_reader = csv.reader(csv_file)
+
+            # Posición de cada campo según el encabezado (evita crear un dict por fila)
+            header = next(csv_reader, [])
+            idx = {name.strip(): i for i, name in enumerate(header)}
+            required = ["database", "table", "column", "current_type", "optimized_type"]
+            missing = [name for name in required if name not in idx]
+            if missing:
+                raise ValueError(f"Faltan columnas en el encabezado: {', '.join(missing)}")
+            DB, TBL, COL, CURRENT, OPTIMIZED = (idx[name] for name in required)
+            # Tipo completo (p. ej. varchar(255)); los reportes antiguos solo traen current_type
+            CURRENT = idx.get("current_column_type", CURRENT)
 
             for row in csv_reader:
                 # Validación y extracción segura de datos
                 try:
-                    db = row.get("database", "").strip()
-                    tbl = row.get("table", "").strip()
-                    col = row.get("column", "").strip()
-                    current = row.get("current_type", "").strip()
-                    optimized = row.get("optimized_type", "").strip()
+                    db = row[DB].strip()
+                    tbl = row[TBL].strip()
+                    col = row[COL].strip()
+                    current = row[CURRENT].strip()
+                    optimized = row[OPTIMIZED].strip()
 
                     if not all([db, tbl, col, current, optimized]):
                         raise ValueError("Faltan valores requeridos en alguna columna")
 
-                    # Construcción CORRECTA de la consulta
-                    alter_query = (
-                        f"-- Cambio recomendado para {db}.{tbl}.{col}\n"
-                        f"-- Tipo actual: {current} | Tipo sugerido: {optimized}\n"
-                        f"ALTER TABLE {db}.{tbl} MODIFY COLUMN {col} {optimized};\n\n"
-                    )
+                    # Omitir columnas sin cambio de tipo (el ALTER reconstruiría la tabla igualmente).
+                    # Se compara con el tipo completo, así varchar(255) == VARCHAR(255)
+                    if current.lower() == optimized.lower():
+                        continue
 
-                    queries.append(alter_query)
+                    changes.append((db, tbl, col, current, optimized))
 
                 except Exception as e:
                     print(f"Error procesando fila: {str(e)}")
                     continue
 
+        # Un ALTER TABLE por tabla con todos sus cambios
+        queries = []
+        changes.sort(key=itemgetter(0, 1))
+        for (db, tbl), group in groupby(changes, key=itemgetter(0, 1)):
+            group = list(group)
+            header = f"-- Cambios recomendados para {db}.{tbl}\n" + "".join(
+                f"-- {col}: Tipo actual: {current} | Tipo sugerido: {optimized}\n"
+                for _, _, col, current, optimized in group
+            )
+            modifications = ",\n    ".join(
+                f"MODIFY COLUMN {_ident(col)} {optimized}" for _, _, col, _, optimized in group
+            )
+            queries.append(f"{header}ALTER TABLE {_ident(db)}.{_ident(tbl)}\n    {modifications};\n\n")
+
         return queries
 
     except FileNotFoundError:
@@ -56,13 +91,12 @@ def save_queries_to_file(queries: List[str], output_path: str) -> None:
     """
     try:
         with open(output_path, "w", encoding="utf-8") as sql_file:
+            # Una única escritura con todo el script
             sql_file.write(
                 "-- Script generado automáticamente para optimización de esquema\n"
-            )
-            sql_file.write(
                 "-- Tipos de datos actuales se muestran como comentarios\n\n"
+                + "".join(queries)
             )
-            sql_file.writelines(queries)
     except Exception as e:
         raise Exception(f"Error al guardar el archivo SQL: {str(e)}")
 